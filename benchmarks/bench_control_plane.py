@@ -0,0 +1,257 @@
+# 控制面板接口基准测试：用 fake_tools 中的 screen/sudo/steamcmd 和模拟 DST 服务器搭建完整环境，
+# 对运维常用的接口跑可重复的延迟/吞吐场景。--save 保存结果作为基线，--compare 与基线比较，
+# 中位数或 P95 变慢超过阈值时报告回归并以非零状态退出
+import argparse
+import json
+import logging
+import os
+import signal
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+FAKE_TOOLS = os.path.join(BENCH_DIR, 'fake_tools')
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import main
+
+CLUSTER_INI = """[GAMEPLAY]
+game_mode = survival
+max_players = 6
+pvp = false
+
+[NETWORK]
+cluster_name = bench
+cluster_password =
+tick_rate = 15
+
+[SHARD]
+shard_enabled = true
+bind_ip = 127.0.0.1
+master_ip = 127.0.0.1
+master_port = 10889
+"""
+
+# 兼具人数变化和聊天的日志，用来填充历史日志
+LOG_TEMPLATES = [
+    'Serializing user: session/0123456789ABCDEF/Wilson/0000000{n}',
+    '[Join Announcement] Player{n}',
+    '[Say] (KU_{n:08x}) Player{n}: anyone seen the beefalo?',
+    '[Leave Announcement] Player{n}',
+    '[Season] Day {n} begins',
+    'Resetting cached object to 0x{n:x}',
+]
+
+
+def write_log(path, lines):
+    with open(path, 'w', encoding='utf-8') as f:
+        for n in range(lines):
+            f.write(f'[{n // 3600:02d}:{n // 60 % 60:02d}:{n % 60:02d}]: {LOG_TEMPLATES[n % len(LOG_TEMPLATES)].format(n=n)}\n')
+
+
+def build_environment(root, log_lines, mod_count):
+    server_path = f'{root}/server_dst'
+    klei_root = f'{root}/.klei/DoNotStarveTogether'
+    cluster = f'{klei_root}/{main.DEFAULT_CLUSTER}'
+    os.makedirs(f'{server_path}/bin')
+    os.makedirs(f'{server_path}/mods')
+    os.symlink(f'{FAKE_TOOLS}/{main.DST_BINARY}', f'{server_path}/bin/{main.DST_BINARY}')
+
+    mods = ''.join(f'  ["workshop-{1000000 + i}"] = {{ enabled = true, configuration_options = {{ level = {i % 5} }} }},\n'
+                   for i in range(mod_count))
+    for shard, is_master in (('Master', 'true'), ('Caves', 'false')):
+        os.makedirs(f'{cluster}/{shard}/backup/server_log')
+        with open(f'{cluster}/{shard}/server.ini', 'w') as f:
+            f.write(f'[SHARD]\nis_master = {is_master}\n')
+        with open(f'{cluster}/{shard}/modoverrides.lua', 'w') as f:
+            f.write(f'return {{\n{mods}}}\n')
+        write_log(f'{cluster}/{shard}/backup/server_log/server_log_2026-01-01-00-00-00.txt', log_lines)
+        write_log(f'{cluster}/{shard}/server_log.txt', log_lines // 10)
+    with open(f'{cluster}/cluster.ini', 'w') as f:
+        f.write(CLUSTER_INI)
+    os.makedirs(f'{root}/screens')
+
+    os.environ['PATH'] = f"{FAKE_TOOLS}{os.pathsep}{os.environ['PATH']}"
+    os.environ['FAKE_SCREEN_DIR'] = f'{root}/screens'
+    os.environ['FAKE_KLEI_ROOT'] = klei_root
+
+    main.SERVER_PATH = server_path
+    main.STEAMCMD_PATH = f'{FAKE_TOOLS}/steamcmd.sh'
+    main.KLEI_ROOT = klei_root
+    main.CONFIG_PATH = cluster
+    main.MOD_SETUP_PATH = f'{server_path}/mods/dedicated_server_mods_setup.lua'
+    main.MOD_MANIFEST_PATH = f'{server_path}/mods/mod_manifest.json'
+    main.APP_MANIFEST_PATH = f'{server_path}/steamapps/appmanifest_{main.DST_APP_ID}.acf'
+    main.UPDATE_CHECK_COMMAND = [main.STEAMCMD_PATH, '+login', 'anonymous', '+app_info_print', main.DST_APP_ID, '+quit']
+    main.BACKUP_ROOT = f'{root}/backups'
+    main.AGENTS_PATH = f'{root}/agents.json'
+    # 生产环境中文件已属于 dst 用户，属主检查走进程内的快速路径
+    main.get_user_ids = lambda user: (os.getuid(), os.getgid())
+    main.invalidate_cluster_cache()
+    # 后台线程（备份、更新检查、历史记录等）会干扰测量，不启动
+    main._background_started.set()
+
+
+def stop_fake_sessions(root):
+    for name in os.listdir(f'{root}/screens'):
+        if name.endswith('.pid'):
+            try:
+                with open(f'{root}/screens/{name}') as f:
+                    os.killpg(int(f.read()), signal.SIGKILL)
+            except (OSError, ValueError):
+                pass
+
+
+class Client:
+    def __init__(self):
+        self.client = main.app.test_client()
+        self.headers = {'X-API-Key': main.API_KEY}
+        self.state = {}
+
+    def request(self, method, path, headers=None, **kwargs):
+        response = self.client.open(path, method=method, headers={**self.headers, **(headers or {})}, **kwargs)
+        if response.status_code >= 400:
+            raise RuntimeError(f'{method} {path} -> {response.status_code}: {response.get_data(as_text=True)[:200]}')
+        return response
+
+
+def config_get_304(client):
+    etag = client.state.get('etag')
+    response = client.request('GET', '/config', headers={'If-None-Match': etag} if etag else None)
+    client.state['etag'] = response.headers.get('ETag', etag)
+
+
+def config_post(client):
+    client.state['players'] = client.state.get('players', 6) % 12 + 1
+    client.request('POST', '/config', json={'游戏设置': {'最大玩家数': client.state['players']}})
+
+
+def mods_patch(client):
+    if 'version' not in client.state:
+        client.state['version'] = client.request('GET', '/mods').json['version']
+    client.state['enabled'] = not client.state.get('enabled', True)
+    response = client.request('PATCH', '/mods', json={
+        'version': client.state['version'],
+        'patch': {'workshop-1000000': {'enabled': client.state['enabled']}}
+    })
+    client.state['version'] = response.json['version']
+
+
+def status_uncached(client):
+    main.invalidate_status_cache()
+    client.request('GET', '/status')
+
+
+def start_stop(client):
+    client.request('POST', '/start_all?timeout=30')
+    client.request('POST', '/stop_all?timeout=30')
+
+
+# (名称, 函数, 是否为慢场景)；慢场景使用 --slow-iterations
+SCENARIOS = [
+    ('status', lambda client: client.request('GET', '/status'), False),
+    ('status_uncached', status_uncached, False),
+    ('config_get', lambda client: client.request('GET', '/config'), False),
+    ('config_get_304', config_get_304, False),
+    ('config_post', config_post, False),
+    ('mods_get', lambda client: client.request('GET', '/mods'), False),
+    ('mods_patch', mods_patch, False),
+    ('logs_tail', lambda client: client.request('GET', '/logs/overworld?lines=200'), False),
+    ('logs_search', lambda client: client.request('GET', '/logs/search?q=beefalo+player42&limit=50'), False),
+    ('update_check', lambda client: client.request('GET', '/update?refresh=1'), True),
+    ('start_stop', start_stop, True),
+]
+
+
+def run_scenario(function, iterations, warmup):
+    client = Client()
+    for _ in range(warmup):
+        function(client)
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        function(client)
+        latencies.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'iterations': iterations,
+        'mean_ms': statistics.mean(latencies) * 1000,
+        'p50_ms': statistics.median(latencies) * 1000,
+        'p95_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'per_second': iterations / elapsed
+    }
+
+
+def compare(results, baseline, threshold, noise_ms):
+    # 返回回归列表：中位数或 P95 比基线慢超过 threshold，且绝对差值超过噪声下限
+    regressions = []
+    print(f"\n{'场景':<16} {'P50 基线':>10} {'P50 当前':>10} {'变化':>8} {'P95 基线':>10} {'P95 当前':>10} {'变化':>8}")
+    for name, result in results.items():
+        previous = baseline.get('results', {}).get(name)
+        if previous is None:
+            print(f'{name:<16} {"(无基线)":>10}')
+            continue
+        row = [f'{name:<16}']
+        for metric in ('p50_ms', 'p95_ms'):
+            before, after = previous[metric], result[metric]
+            change = (after - before) / before if before else 0.0
+            regressed = change > threshold and after - before > noise_ms
+            if regressed:
+                regressions.append((name, metric, before, after))
+            row.append(f'{before:>10.2f} {after:>10.2f} {change * 100:>+7.1f}%{"!" if regressed else " "}')
+        print(' '.join(row))
+    return regressions
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenarios', nargs='+', choices=[name for name, _, _ in SCENARIOS])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--slow-iterations', type=int, default=3)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--log-lines', type=int, default=200000)
+    parser.add_argument('--mods', type=int, default=100)
+    parser.add_argument('--save', help='把结果保存为基线 JSON')
+    parser.add_argument('--compare', help='与基线 JSON 比较')
+    parser.add_argument('--threshold', type=float, default=0.2, help='允许变慢的比例')
+    parser.add_argument('--noise-ms', type=float, default=0.5, help='小于该差值（毫秒）的变化视为噪声')
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    selected = [scenario for scenario in SCENARIOS if not args.scenarios or scenario[0] in args.scenarios]
+    results = {}
+    with tempfile.TemporaryDirectory() as root:
+        build_environment(root, args.log_lines, args.mods)
+        try:
+            print(f"{'场景':<16} {'次数':>6} {'平均(ms)':>10} {'P50(ms)':>10} {'P95(ms)':>10} {'最大(ms)':>10} {'次/秒':>10}")
+            for name, function, slow in selected:
+                iterations = args.slow_iterations if slow else args.iterations
+                result = run_scenario(function, iterations, min(args.warmup, 1) if slow else args.warmup)
+                results[name] = result
+                print(f"{name:<16} {iterations:>6} {result['mean_ms']:>10.2f} {result['p50_ms']:>10.2f} "
+                      f"{result['p95_ms']:>10.2f} {result['max_ms']:>10.2f} {result['per_second']:>10.1f}")
+        finally:
+            stop_fake_sessions(root)
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'created': time.time(), 'python': sys.version.split()[0], 'results': results}, f, indent=2)
+        print(f'\n结果已保存到 {args.save}')
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold, args.noise_ms)
+        if regressions:
+            print(f'\n发现 {len(regressions)} 项回归:')
+            for name, metric, before, after in regressions:
+                print(f'  {name} {metric}: {before:.2f} -> {after:.2f} ms')
+            sys.exit(1)
+        print('\n没有发现回归')
+
+
+if __name__ == '__main__':
+    main_bench()
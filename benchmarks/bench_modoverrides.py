@@ -0,0 +1,57 @@
+# modoverrides.lua 解析性能测试：生成大型模组包，分别测量冷解析和缓存命中的耗时
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+def build_modpack(mod_count, options_per_mod):
+    lines = ["-- 由 bench_modoverrides.py 生成", "return {"]
+    for i in range(mod_count):
+        options = ", ".join(
+            f'["option_{j}"] = {j}' if j % 3 else f'option_{j} = "value \\"{j}\\""'
+            for j in range(options_per_mod)
+        )
+        lines.append(f'  ["workshop-{1000000 + i}"] = {{ enabled = true, configuration_options = {{ {options}, list = {{ 1, 2, 3 }} }} }},')
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def measure(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mods', type=int, nargs='+', default=[10, 100, 500])
+    parser.add_argument('--options', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as config_path:
+        os.makedirs(f"{config_path}/Master")
+        main.CONFIG_PATH = config_path
+        path = f"{config_path}/Master/modoverrides.lua"
+
+        print(f"{'模组数':>8} {'文件大小':>10} {'解析(ms)':>10} {'缓存读取(us)':>14}")
+        for mod_count in args.mods:
+            content = build_modpack(mod_count, args.options)
+            with open(path, 'w') as f:
+                f.write(content)
+
+            parse_time = measure(lambda: main.parse_lua_table(content), args.repeat)
+            assert len(main.read_modoverrides()) == mod_count
+            cached_time = measure(main.read_modoverrides, args.repeat * 100)
+            print(f"{mod_count:>8} {len(content):>10} {parse_time * 1000:>10.2f} {cached_time * 1e6:>14.2f}")
+
+
+if __name__ == '__main__':
+    main_bench()
@@ -0,0 +1,102 @@
+# WSGI 服务并发测试：在不同线程数下用大量并发客户端请求 /status 和 /config，测量吞吐和延迟
+import argparse
+import http.client
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+CLUSTER_INI = """[GAMEPLAY]
+game_mode = survival
+max_players = 6
+pvp = false
+
+[NETWORK]
+cluster_name = bench
+cluster_password =
+tick_rate = 15
+
+[SHARD]
+shard_enabled = true
+bind_ip = 127.0.0.1
+master_ip = 127.0.0.1
+master_port = 10889
+"""
+
+
+def setup_cluster(root):
+    cluster = f"{root}/{main.DEFAULT_CLUSTER}"
+    for shard, is_master in (('Master', 'true'), ('Caves', 'false')):
+        os.makedirs(f"{cluster}/{shard}")
+        with open(f"{cluster}/{shard}/server.ini", 'w') as f:
+            f.write(f"[SHARD]\nis_master = {is_master}\n")
+    with open(f"{cluster}/cluster.ini", 'w') as f:
+        f.write(CLUSTER_INI)
+    main.KLEI_ROOT = root
+    main.CONFIG_PATH = cluster
+    main.invalidate_cluster_cache()
+    # 后台线程（备份、更新检查、历史记录等）会干扰测量，不启动
+    main._background_started.set()
+
+
+def request(port, path):
+    start = time.perf_counter()
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        connection.request('GET', path, headers={'X-API-Key': main.API_KEY})
+        response = connection.getresponse()
+        response.read()
+        ok = response.status == 200
+    finally:
+        connection.close()
+    return ok, time.perf_counter() - start
+
+
+def run_load(port, path, clients, total):
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        start = time.perf_counter()
+        results = list(executor.map(lambda _: request(port, path), range(total)))
+        elapsed = time.perf_counter() - start
+    latencies = sorted(latency for _, latency in results)
+    errors = sum(1 for ok, _ in results if not ok)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return total / elapsed, statistics.median(latencies), p99, errors
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--clients', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=1000)
+    args = parser.parse_args()
+
+    # 每个请求一行的访问日志会干扰测量
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    main.logger.setLevel(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as root:
+        setup_cluster(root)
+        print(f"{'线程数':>6} {'接口':>8} {'请求/秒':>10} {'中位数(ms)':>12} {'P99(ms)':>10} {'失败':>6}")
+        for threads in args.threads:
+            server = main.PooledWSGIServer('127.0.0.1', 0, main.app, threads)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            try:
+                for path in ('/status', '/config'):
+                    rps, median, p99, errors = run_load(server.server_port, path, args.clients, args.requests)
+                    print(f"{threads:>6} {path:>8} {rps:>10.0f} {median * 1000:>12.2f} {p99 * 1000:>10.2f} {errors:>6}")
+            finally:
+                server.shutdown()
+                server.server_close()
+
+
+if __name__ == '__main__':
+    main_bench()
@@ -0,0 +1,100 @@
+# 模拟 DST 专用服务器：按真实格式写 server_log.txt，响应控制台命令，收到 c_shutdown 后退出。
+# 由同目录的 dontstarve_dedicated_server_nullrenderer 启动，日志根目录来自 FAKE_KLEI_ROOT
+import os
+import re
+import signal
+import sys
+import time
+
+BOOT_SECONDS = float(os.environ.get('FAKE_DST_BOOT', 0.5))
+TICK_SECONDS = float(os.environ.get('FAKE_DST_TICK', 0.2))
+SHUTDOWN_SECONDS = float(os.environ.get('FAKE_DST_SHUTDOWN', 0.3))
+PLAYERS = ['Wilson', 'Willow', 'Wolfgang', 'Wendy', 'WX-78', 'Wickerbottom']
+
+
+def option(args, name, default):
+    return args[args.index(name) + 1] if name in args and args.index(name) + 1 < len(args) else default
+
+
+def only_update_server_mods():
+    # 按 dedicated_server_mods_setup.lua 生成已下载的MOD目录
+    mods = os.path.abspath('../mods')
+    try:
+        with open(f'{mods}/dedicated_server_mods_setup.lua', 'r', encoding='utf-8') as f:
+            workshop_ids = re.findall(r'ServerModSetup\("(\d+)"\)', f.read())
+    except OSError:
+        workshop_ids = []
+    for workshop_id in workshop_ids:
+        os.makedirs(f'{mods}/workshop-{workshop_id}', exist_ok=True)
+        with open(f'{mods}/workshop-{workshop_id}/modinfo.lua', 'w', encoding='utf-8') as f:
+            f.write(f'name = "mod {workshop_id}"\nversion = "1.0.{int(workshop_id) % 10}"\n')
+
+
+def main():
+    args = sys.argv[1:]
+    if '-only_update_server_mods' in args:
+        only_update_server_mods()
+        return
+
+    cluster = option(args, '-cluster', 'Cluster_1')
+    shard = option(args, '-shard', 'Master')
+    log_path = f"{os.environ['FAKE_KLEI_ROOT']}/{cluster}/{shard}/server_log.txt"
+    console_path = os.environ.get('FAKE_CONSOLE')
+    started = time.monotonic()
+    log = open(log_path, 'w', encoding='utf-8', buffering=1)
+
+    def write(message):
+        uptime = int(time.monotonic() - started)
+        log.write(f'[{uptime // 3600:02d}:{uptime // 60 % 60:02d}:{uptime % 60:02d}]: {message}\n')
+
+    def terminate(signum, frame):
+        write('Received signal, shutting down')
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGHUP, terminate)
+
+    write('Starting Up')
+    write('Version: 999999')
+    write(f'Current time: {time.ctime()}')
+    write(f'Loading cluster {cluster}, shard {shard}')
+    time.sleep(BOOT_SECONDS)
+    write('Sim paused')
+    write('Server registered via geo DNS in ap-southeast')
+
+    console_offset = 0
+    tick = 0
+    day = 1
+    while True:
+        time.sleep(TICK_SECONDS)
+        tick += 1
+        player = PLAYERS[tick % len(PLAYERS)]
+        if tick % 50 == 0:
+            day += 1
+            write(f'[Season] Day {day} begins')
+        elif tick % 7 == 0:
+            write(f'[Join Announcement] {player}')
+        elif tick % 11 == 0:
+            write(f'[Say] (KU_{tick:08x}) {player}: anyone seen the beefalo?')
+        elif tick % 13 == 0:
+            write(f'[Leave Announcement] {player}')
+        else:
+            write(f'Serializing user: session/0123456789ABCDEF/{player}/0000000{tick % 10}')
+
+        if not console_path or not os.path.exists(console_path):
+            continue
+        with open(console_path, 'r', encoding='utf-8') as f:
+            f.seek(console_offset)
+            data = f.read()
+            console_offset = f.tell()
+        for command in filter(None, (line.strip() for line in data.replace('\r', '\n').split('\n'))):
+            write(f'RemoteCommandInput: "{command}"')
+            if command.startswith('c_shutdown'):
+                write('Shutting down')
+                time.sleep(SHUTDOWN_SECONDS)
+                write('[Shard] Shard server stopped')
+                return
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+# 模拟 steamcmd：app_info_print 输出 FAKE_LATEST_BUILD 作为最新版本，app_update 写入 appmanifest
+import os
+import sys
+import time
+
+args = sys.argv[1:]
+app_id = '343050'
+latest = os.environ.get('FAKE_LATEST_BUILD', '1000')
+install_dir = args[args.index('+force_install_dir') + 1] if '+force_install_dir' in args else '.'
+print('Redirecting stderr to \'/tmp/steamcmd-stderr.txt\'')
+print('Logging in user \'anonymous\' to Steam Public...OK')
+
+if '+app_info_print' in args:
+    print(f'AppID : {app_id}, change number : 1/0, last change : {time.ctime()}')
+    print(f'"{app_id}"\n{{\n\t"common"\n\t{{\n\t\t"name"\t\t"Don\'t Starve Together Dedicated Server"\n\t}}')
+    print(f'\t"depots"\n\t{{\n\t\t"branches"\n\t\t{{\n\t\t\t"public"\n\t\t\t{{\n\t\t\t\t"buildid"\t\t"{latest}"\n\t\t\t}}\n\t\t}}\n\t}}\n}}')
+
+if '+app_update' in args:
+    os.makedirs(f'{install_dir}/steamapps', exist_ok=True)
+    with open(f'{install_dir}/steamapps/appmanifest_{app_id}.acf', 'w') as f:
+        f.write(f'"AppState"\n{{\n\t"appid"\t\t"{app_id}"\n\t"buildid"\t\t"{latest}"\n}}\n')
+    print(f"Success! App '{app_id}' fully installed.")
@@ -5,9 +5,29 @@ import logging
 import time
 import shlex
 import pwd
-from flask import Flask, request, jsonify, send_file
-from functools import wraps
+import stat
+import threading
+import uuid
+import mmap
+import re
+import json
+import glob
+import sqlite3
+import http.client
+import copy
+import hashlib
+import shutil
+import zlib
+import io
+import signal
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait as wait_futures
+from flask import Flask, Response, g, request, jsonify, send_file, stream_with_context
+from functools import wraps, lru_cache
 from flask_cors import CORS
+from urllib.parse import urlsplit, urlencode
+from werkzeug.serving import BaseWSGIServer
 
 app = Flask(__name__)
 CORS(app)
@@ -20,7 +40,134 @@ logger = logging.getLogger(__name__)
 SERVER_ROOT = '/home/dst'
 STEAMCMD_PATH = f'{SERVER_ROOT}/steamcmd.sh'
 SERVER_PATH = f'{SERVER_ROOT}/server_dst'
-CONFIG_PATH = f'{SERVER_ROOT}/.klei/DoNotStarveTogether/MyDediServer'
+KLEI_ROOT = f'{SERVER_ROOT}/.klei/DoNotStarveTogether'
+DEFAULT_CLUSTER = 'MyDediServer'
+CONFIG_PATH = f'{KLEI_ROOT}/{DEFAULT_CLUSTER}'
+DST_BINARY = 'dontstarve_dedicated_server_nullrenderer'
+
+# 旧接口的分片别名 -> 存档目录；默认集群沿用原来的screen会话名
+SHARD_ALIASES = {'overworld': 'Master', 'caves': 'Caves'}
+LEGACY_SCREEN_NAMES = {'Master': 'dst_server1', 'Caves': 'dst_server2'}
+
+# 集群注册表缓存时间（秒）及并行操作分片的线程数
+CLUSTER_CACHE_TTL = 10
+SHARD_WORKERS = 8
+
+# MOD同步：本地清单记录已下载的创意工坊MOD及版本
+MOD_SETUP_PATH = f'{SERVER_PATH}/mods/dedicated_server_mods_setup.lua'
+MOD_MANIFEST_PATH = f'{SERVER_PATH}/mods/mod_manifest.json'
+# 分片启动时跳过自带的MOD更新（-skip_update_server_mods），距上次检查超过该秒数时在启动前重新下载一次，0 表示不检查
+MOD_REFRESH_INTERVAL = 6 * 3600
+MOD_VERSION_RE = re.compile(r'^\s*version\s*=\s*["\']([^"\']*)["\']', re.MULTILINE)
+
+# 分片就绪检测：日志中出现这些标记即认为启动完成
+READY_MARKERS = (b'Sim paused', b'Server registered')
+READY_TIMEOUT = 120
+READY_POLL_INTERVAL = 0.2
+
+# 优雅停止：发送 c_shutdown(true) 存档退出，超过期限仍未退出则强制结束 screen 会话
+SHUTDOWN_COMMAND = 'c_shutdown(true)'
+SHUTDOWN_TIMEOUT = 60
+SHUTDOWN_POLL_INTERVAL = 0.5
+
+# 状态缓存时间（秒），启动/停止操作会使其立即失效
+STATUS_CACHE_TTL = 2
+
+# 子进程：同时运行的命令数上限、默认超时（秒）、保留的输出行数
+COMMAND_CONCURRENCY = 4
+COMMAND_TIMEOUT = 300
+STEAMCMD_TIMEOUT = 3600
+COMMAND_OUTPUT_LINES = 200
+# 超时后先对整个进程组发 SIGTERM，等待该秒数仍未退出则 SIGKILL
+COMMAND_KILL_GRACE = 5
+
+# 自动更新：比较 appmanifest 中已安装的 buildid 与 Steam 上的最新 buildid，只有版本不同才停服更新。
+# UPDATE_CHECK_COMMAND 需输出 app_info_print 的内容，可替换为本地桩程序；
+# 检查结果缓存时间、定时检查间隔（秒，0 表示关闭）、发现新版本时是否自动停服更新（默认只记录）
+DST_APP_ID = '343050'
+APP_MANIFEST_PATH = f'{SERVER_PATH}/steamapps/appmanifest_{DST_APP_ID}.acf'
+UPDATE_BRANCH = 'public'
+UPDATE_CHECK_COMMAND = [STEAMCMD_PATH, '+login', 'anonymous', '+app_info_update', '1', '+app_info_print', DST_APP_ID, '+quit']
+UPDATE_CHECK_CACHE_TTL = 60
+UPDATE_CHECK_INTERVAL = 1800
+AUTO_UPDATE = False
+VDF_TOKEN_RE = re.compile(r'"((?:[^"\\]|\\.)*)"|([{}])')
+
+# 后台任务线程池大小及保留的已完成任务数量
+JOB_WORKERS = 2
+JOB_HISTORY_LIMIT = 50
+
+# 存档备份：按内容寻址、分块去重存储，新分块在进程池中压缩。
+# 自动备份间隔（秒，0 表示关闭）、保留最近的快照数及按天保留的天数
+BACKUP_ROOT = f'{SERVER_ROOT}/backups'
+BACKUP_CHUNK_SIZE = 1 << 20
+BACKUP_BATCH_CHUNKS = 64
+BACKUP_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+BACKUP_COMPRESS_LEVEL = 6
+BACKUP_INTERVAL = 3600
+BACKUP_KEEP_LAST = 24
+BACKUP_KEEP_DAILY = 7
+SNAPSHOT_ID_RE = re.compile(r'^\d{8}-\d{6}-[0-9a-f]{6}$')
+
+# 日志接口：默认返回的行数、单次返回的最大字节数、follow模式轮询间隔（秒）
+LOG_TAIL_LINES = 200
+LOG_CHUNK_LIMIT = 256 * 1024
+LOG_FOLLOW_INTERVAL = 1
+LOG_FOLLOW_KEEPALIVE = 15
+
+# 日志搜索：索引当前日志和 backup/server_log/ 中的历史日志，增量读取的块大小及分页大小
+LOG_INDEX_CHUNK = 4 * 1024 * 1024
+LOG_SEARCH_PAGE_SIZE = 50
+LOG_SEARCH_MAX_PAGE_SIZE = 500
+LOG_TOKEN_RE = re.compile(r'\w+')
+
+# 指标：直方图的分桶边界（秒）
+METRIC_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+
+# 遥测：日志轮询间隔（秒）及内存中保留的事件数
+TELEMETRY_INTERVAL = 2
+TELEMETRY_EVENT_LIMIT = 2000
+TELEMETRY_STREAM_KEEPALIVE = 15
+
+# 资源监控：采样间隔（秒）、每个分片保留的样本数；内存（字节）或 CPU（%）连续超过阈值
+# RESOURCE_ALERT_SAMPLES 次时告警，开启自动重启时内存告警会重启该分片（冷却时间内最多一次）
+RESOURCE_INTERVAL = 5
+RESOURCE_HISTORY = 720
+RESOURCE_ALERT_RSS = 4 << 30
+RESOURCE_ALERT_CPU = 95
+RESOURCE_ALERT_SAMPLES = 6
+RESOURCE_AUTO_RESTART = False
+RESOURCE_RESTART_COOLDOWN = 1800
+
+# 历史记录：定时采样分片状态和在线人数存入 SQLite，按 原始 -> 1分钟 -> 1小时 逐级汇总。
+# 各级的保留时间（秒），超过后删除，磁盘占用有上限
+HISTORY_PATH = f'{SERVER_ROOT}/panel_history.db'
+HISTORY_INTERVAL = 10
+HISTORY_LEVELS = ((0, 6 * 3600), (60, 7 * 86400), (3600, 400 * 86400))
+HISTORY_MAX_POINTS = 1000
+
+# 控制台命令：合并窗口、同一分片两次注入的最小间隔、等待日志输出的时间（秒）及各项上限
+CONSOLE_BATCH_WINDOW = 0.1
+CONSOLE_MIN_INTERVAL = 0.5
+CONSOLE_OUTPUT_WAIT = 1
+CONSOLE_MAX_COMMANDS = 20
+CONSOLE_MAX_COMMAND_LENGTH = 1000
+CONSOLE_QUEUE_LIMIT = 50
+CONSOLE_OUTPUT_LINES = 100
+
+# 服务方式：production 为固定线程池的 WSGI 服务器，debug 为 Flask 开发服务器（自动重载、单线程）。
+# 日志跟踪和事件流会长期占用线程，线程数应大于同时打开的面板数
+SERVER_HOST = os.environ.get('DST_PANEL_HOST', '0.0.0.0')
+SERVER_PORT = int(os.environ.get('DST_PANEL_PORT', 5000))
+SERVER_MODE = os.environ.get('DST_PANEL_MODE', 'production')
+SERVER_THREADS = int(os.environ.get('DST_PANEL_THREADS', 32))
+# 多主机控制：登记的代理（其他主机上的本面板）及其 API 密钥保存在 AGENTS_PATH。
+# 单个主机的默认超时（秒）：查询类请求较短，启动/停止等操作需要等待分片就绪，较长。
+# 代理每个响应后都会关闭连接（HTTP/1.0），因此每次请求新建连接
+AGENTS_PATH = f'{SERVER_ROOT}/panel_agents.json'
+AGENT_TIMEOUT = 5
+AGENT_ACTION_TIMEOUT = 180
+AGENT_WORKERS = 16
 
 # 简单的身份验证
 API_KEY = "123"  # 请更改为安全的API密钥
@@ -60,6 +207,28 @@ config_mapping = {
 
 # 反向映射
 reverse_mapping = {v: k for k, v in config_mapping.items()}
+
+# cluster.ini 字段类型：bool、(int, 最小值, 最大值)、(choice, 可选值)；未列出的字段按字符串处理
+CONFIG_SCHEMA = {
+    'game_mode': ('choice', ('survival', 'endless', 'wilderness', 'lavaarena', 'quagmire')),
+    'max_players': ('int', 1, 64),
+    'pvp': 'bool',
+    'pause_when_empty': 'bool',
+    'vote_enabled': 'bool',
+    'vote_kick_enabled': 'bool',
+    'lan_only_cluster': 'bool',
+    'cluster_intention': ('choice', ('cooperative', 'competitive', 'social', 'madness')),
+    'offline_cluster': 'bool',
+    'whitelist_slots': ('int', 0, 64),
+    'tick_rate': ('int', 1, 60),
+    'console_enabled': 'bool',
+    'max_snapshots': ('int', 1, 1000),
+    'shard_enabled': 'bool',
+    'master_port': ('int', 1, 65535),
+    'steam_group_only': 'bool',
+    'steam_group_id': ('int', 0, None),
+    'steam_group_admins': 'bool'
+}
 def require_api_key(view_function):
     @wraps(view_function)
     def decorated_function(*args, **kwargs):
@@ -72,26 +241,262 @@ def require_api_key(view_function):
             return jsonify({"状态": "错误", "消息": "无效的API密钥"}), 401
     return decorated_function
 
-def run_command(command, use_sudo=False, user='dst'):
+METRIC_HELP = {
+    'dst_http_requests_total': ('counter', 'HTTP请求数'),
+    'dst_http_request_duration_seconds': ('histogram', 'HTTP请求耗时'),
+    'dst_commands_total': ('counter', '执行的子进程数'),
+    'dst_command_duration_seconds': ('histogram', '子进程耗时'),
+    'dst_cache_requests_total': ('counter', '缓存查询数'),
+    'dst_jobs_in_flight': ('gauge', '等待中或运行中的后台任务数')
+}
+
+_metrics_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+
+def inc_counter(name, labels=(), value=1):
+    key = (name, tuple(labels))
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, value, labels=()):
+    key = (name, tuple(labels))
+    with _metrics_lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            # 每个分桶的计数，最后两项是总和与总数
+            histogram = _histograms[key] = [0] * len(METRIC_BUCKETS) + [0.0, 0]
+        for index, bound in enumerate(METRIC_BUCKETS):
+            if value <= bound:
+                histogram[index] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+def record_cache(cache, hit):
+    inc_counter('dst_cache_requests_total', (('cache', cache), ('result', 'hit' if hit else 'miss')))
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels) + '}'
+
+def render_metrics(gauges=()):
+    # Prometheus 文本格式
+    with _metrics_lock:
+        counters = dict(_counters)
+        histograms = {key: list(value) for key, value in _histograms.items()}
+    series = {}
+    for (name, labels), value in sorted(counters.items()):
+        series.setdefault(name, []).append(f"{name}{_format_labels(labels)} {value}")
+    for (name, labels), histogram in sorted(histograms.items()):
+        lines = series.setdefault(name, [])
+        for bound, count in zip(METRIC_BUCKETS, histogram):
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', f'{bound:g}'),))} {count}")
+        lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram[-1]}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram[-2]:.6f}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram[-1]}")
+    for name, labels, value in gauges:
+        series.setdefault(name, []).append(f"{name}{_format_labels(labels)} {value}")
+
+    output = []
+    for name in sorted(series):
+        metric_type, help_text = METRIC_HELP.get(name, ('untyped', name))
+        output.append(f"# HELP {name} {help_text}")
+        output.append(f"# TYPE {name} {metric_type}")
+        output.extend(series[name])
+    return '\n'.join(output) + '\n'
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        labels = (('method', request.method), ('route', route))
+        observe('dst_http_request_duration_seconds', time.perf_counter() - started, labels)
+        inc_counter('dst_http_requests_total', labels + (('status', str(response.status_code)),))
+    return response
+
+def command_kind(argv):
+    # 指标中按命令类型统计：screen、steamcmd、chown 等
+    if not argv:
+        return 'unknown'
+    name = os.path.basename(argv[0])
+    if name.startswith('steamcmd'):
+        return 'steamcmd'
+    if DST_BINARY in name:
+        return 'dst'
+    return name
+
+_command_slots = threading.BoundedSemaphore(COMMAND_CONCURRENCY)
+# 面板关闭时置位，SSE 等长连接据此结束
+_shutdown_event = threading.Event()
+_job_context = threading.local()
+
+def _drain_stream(stream, lines, on_output=None):
+    for line in stream:
+        lines.append(line)
+        if on_output:
+            on_output(line)
+
+def kill_process_group(process):
+    # 先 SIGTERM（sudo 会转发给实际命令），宽限期后 SIGKILL 整个进程组
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            return
+        except PermissionError:
+            process.kill()
+            return
+        if sig == signal.SIGTERM:
+            try:
+                process.wait(COMMAND_KILL_GRACE)
+                return
+            except subprocess.TimeoutExpired:
+                pass
+
+def _record_job_output(line, job):
+    if job is not None:
+        with _jobs_lock:
+            job['output'].append(line.rstrip('\n'))
+
+def run_command(command, use_sudo=False, user='dst', timeout=COMMAND_TIMEOUT, on_output=None,
+                max_lines=COMMAND_OUTPUT_LINES, cwd=None):
+    # 不经过shell直接执行argv，逐行回调输出，只保留最后 max_lines 行
+    argv = shlex.split(command) if isinstance(command, str) else list(command)
+    kind = command_kind(argv)
+    if use_sudo:
+        argv = ['sudo'] + argv
+    elif user != 'root':
+        argv = ['sudo', '-u', user] + argv
+
+    # 输出在读取线程中处理，提前取出当前任务
+    job = getattr(_job_context, 'job', None)
+    def handle_output(line):
+        logger.debug(f"命令输出: {line.rstrip()}")
+        _record_job_output(line, job)
+        if on_output:
+            on_output(line)
+
+    command_text = shlex.join(argv)
+    if not _command_slots.acquire(timeout=timeout):
+        logger.error(f"等待执行槽位超时: {command_text}")
+        inc_counter('dst_commands_total', (('kind', kind), ('result', 'timeout')))
+        return None, "等待执行槽位超时"
+    outcome = 'error'
+    started = time.monotonic()
     try:
-        if use_sudo:
-            command = f"sudo {command}"
-        elif user != 'root':
-            command = f"sudo -u {user} {command}"
-        
-        logger.info(f"执行命令: {command}")
-        process = subprocess.run(command, shell=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        logger.info(f"命令输出: {process.stdout}")
-        return process.stdout, None
-    except subprocess.CalledProcessError as e:
-        logger.error(f"命令执行失败: {e.stderr}")
-        return None, e.stderr
+        logger.info(f"执行命令: {command_text}")
+        try:
+            # 放到独立的进程组，超时时连同 sudo 启动的实际命令一起结束
+            process = subprocess.Popen(argv, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                       stderr=subprocess.PIPE, text=True, errors='replace', cwd=cwd,
+                                       start_new_session=True)
+        except OSError as e:
+            logger.error(f"命令执行失败: {e}")
+            return None, str(e)
+
+        timed_out = threading.Event()
+        def kill():
+            timed_out.set()
+            kill_process_group(process)
+        timer = threading.Timer(timeout, kill)
+        timer.daemon = True
+        timer.start()
+
+        stdout_lines = deque(maxlen=max_lines)
+        stderr_lines = deque(maxlen=max_lines)
+        readers = [
+            threading.Thread(target=_drain_stream, args=(process.stdout, stdout_lines, handle_output), daemon=True),
+            threading.Thread(target=_drain_stream, args=(process.stderr, stderr_lines), daemon=True),
+        ]
+        for reader in readers:
+            reader.start()
+        try:
+            process.wait()
+        finally:
+            timer.cancel()
+            # 脱离进程组的子进程可能仍占用管道，超时后不再无限等待读取线程
+            for reader in readers:
+                reader.join(COMMAND_KILL_GRACE if timed_out.is_set() else None)
+            if any(reader.is_alive() for reader in readers):
+                logger.warning(f"命令已结束但输出管道仍被占用: {command_text}")
+            else:
+                process.stdout.close()
+                process.stderr.close()
+
+        elapsed = time.monotonic() - started
+        if timed_out.is_set():
+            outcome = 'timeout'
+            logger.error(f"命令执行超时({timeout}秒): {command_text}")
+            return None, f"命令执行超时({timeout}秒)"
+        if process.returncode != 0:
+            error = ''.join(stderr_lines) or f"命令退出码为{process.returncode}"
+            logger.error(f"命令执行失败: {error}")
+            return None, error
+        outcome = 'ok'
+        logger.info(f"命令完成，耗时{elapsed:.2f}秒")
+        return ''.join(stdout_lines), None
+    finally:
+        _command_slots.release()
+        inc_counter('dst_commands_total', (('kind', kind), ('result', outcome)))
+        observe('dst_command_duration_seconds', time.monotonic() - started, (('kind', kind),))
+
+@lru_cache(maxsize=None)
+def get_user_ids(user):
+    entry = pwd.getpwnam(user)
+    return entry.pw_uid, entry.pw_gid
+
+def set_ownership(paths, owner='dst', mode=None):
+    # 批量设置属主和权限：已经正确的路径直接跳过，能在进程内完成的不启动子进程，
+    # 剩下的合并成一次 sudo chmod 和一次 sudo chown
+    try:
+        uid, gid = get_user_ids(owner)
+    except KeyError:
+        uid = gid = None
+
+    pending_chmod = []
+    pending_chown = []
+    for path in paths:
+        try:
+            path_stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if mode is not None and stat.S_IMODE(path_stat.st_mode) != mode:
+            try:
+                os.chmod(path, mode)
+            except PermissionError:
+                pending_chmod.append(path)
+        if uid is None:
+            pending_chown.append(path)
+        elif (path_stat.st_uid, path_stat.st_gid) != (uid, gid):
+            try:
+                os.chown(path, uid, gid)
+            except PermissionError:
+                pending_chown.append(path)
+
+    success = True
+    if pending_chmod:
+        output, error = run_command(['chmod', format(mode, 'o')] + pending_chmod, use_sudo=True)
+        success = success and not error
+    if pending_chown:
+        output, error = run_command(['chown', f'{owner}:{owner}'] + pending_chown, use_sudo=True)
+        success = success and not error
+    return success
 
 def ensure_directory(path, owner='dst'):
     if not os.path.exists(path):
-        os.makedirs(path, exist_ok=True)
-    run_command(f"chown {owner}:{owner} {path}", use_sudo=True)
-    run_command(f"chmod 755 {path}", use_sudo=True)
+        try:
+            os.makedirs(path, exist_ok=True)
+        except PermissionError:
+            run_command(['mkdir', '-p', path], use_sudo=True)
+    set_ownership([path], owner, 0o755)
 
 def install_dependencies():
     logger.info("正在安装依赖项...")
@@ -108,7 +513,11 @@ def install_dependencies():
 
 def setup_user():
     logger.info("正在设置DST用户...")
-    output, error = run_command("id -u dst || useradd -m -d /home/dst dst", use_sudo=True)
+    try:
+        pwd.getpwnam('dst')
+        error = None
+    except KeyError:
+        output, error = run_command("useradd -m -d /home/dst dst", use_sudo=True)
     if error:
         logger.error(f"设置用户时出错: {error}")
         return False
@@ -137,34 +546,24 @@ def install_dst_server():
     
     try:
         # 确保目标目录存在并设置正确的权限
-        run_command(f"mkdir -p {SERVER_PATH}", use_sudo=True)
-        run_command(f"chown dst:dst {SERVER_PATH}", use_sudo=True)
+        ensure_directory(SERVER_PATH)
         
         # 设置 SteamCMD 相关文件和目录的权限
-        steamcmd_files = [
-            STEAMCMD_PATH,
-            os.path.join(os.path.dirname(STEAMCMD_PATH), 'linux32', 'steamcmd'),
-            os.path.join(os.path.dirname(STEAMCMD_PATH), 'linux32', 'steamerrorreporter'),
-            os.path.join(os.path.dirname(STEAMCMD_PATH), 'linux32', 'libstdc++.so.6'),
-            os.path.join(os.path.dirname(STEAMCMD_PATH), 'linux32', 'crashhandler.so')
-        ]
-        
-        for file_path in steamcmd_files:
-            if os.path.exists(file_path):
-                run_command(f"chown dst:dst {file_path}", use_sudo=True)
-                run_command(f"chmod 755 {file_path}", use_sudo=True)
-        
-        # 确保 SteamCMD 目录有正确的权限
         steamcmd_dir = os.path.dirname(STEAMCMD_PATH)
         linux32_dir = os.path.join(steamcmd_dir, 'linux32')
-        
-        for dir_path in [steamcmd_dir, linux32_dir]:
-            if os.path.exists(dir_path):
-                run_command(f"chown dst:dst {dir_path}", use_sudo=True)
-                run_command(f"chmod 755 {dir_path}", use_sudo=True)
+        steamcmd_paths = [
+            STEAMCMD_PATH,
+            os.path.join(linux32_dir, 'steamcmd'),
+            os.path.join(linux32_dir, 'steamerrorreporter'),
+            os.path.join(linux32_dir, 'libstdc++.so.6'),
+            os.path.join(linux32_dir, 'crashhandler.so'),
+            steamcmd_dir,
+            linux32_dir
+        ]
+        set_ownership(steamcmd_paths, 'dst', 0o755)
         
         # 使用dst用户运行SteamCMD
-        output, error = run_command(command, user='dst')
+        output, error = run_command(command, user='dst', timeout=STEAMCMD_TIMEOUT)
         
         if error:
             logger.error(f"安装DST服务器时出错: {error}")
@@ -179,9 +578,9 @@ def install_dst_server():
 
 def configure_server():
     logger.info("正在配置服务器...")
-    ensure_directory(CONFIG_PATH)
-    ensure_directory(f"{CONFIG_PATH}/Master")
-    ensure_directory(f"{CONFIG_PATH}/Caves")
+    for path in [CONFIG_PATH, f"{CONFIG_PATH}/Master", f"{CONFIG_PATH}/Caves"]:
+        os.makedirs(path, exist_ok=True)
+    set_ownership([CONFIG_PATH, f"{CONFIG_PATH}/Master", f"{CONFIG_PATH}/Caves"], 'dst', 0o755)
 
     config = configparser.ConfigParser()
 
@@ -209,7 +608,6 @@ def configure_server():
 
     with open(f'{CONFIG_PATH}/cluster.ini', 'w') as configfile:
         config.write(configfile)
-    run_command(f"chown dst:dst {CONFIG_PATH}/cluster.ini", use_sudo=True)
 
     # server.ini for Overworld
     config = configparser.ConfigParser()
@@ -222,7 +620,6 @@ def configure_server():
 
     with open(f'{CONFIG_PATH}/Master/server.ini', 'w') as configfile:
         config.write(configfile)
-    run_command(f"chown dst:dst {CONFIG_PATH}/Master/server.ini", use_sudo=True)
 
     # server.ini for Caves
     config = configparser.ConfigParser()
@@ -238,7 +635,8 @@ def configure_server():
 
     with open(f'{CONFIG_PATH}/Caves/server.ini', 'w') as configfile:
         config.write(configfile)
-    run_command(f"chown dst:dst {CONFIG_PATH}/Caves/server.ini", use_sudo=True)
+    set_ownership([f'{CONFIG_PATH}/cluster.ini', f'{CONFIG_PATH}/Master/server.ini', f'{CONFIG_PATH}/Caves/server.ini'])
+    invalidate_cluster_cache()
 
     return True
 
@@ -282,12 +680,13 @@ screen -S dst_server2 -X quit > /dev/null 2>&1
 '''
     }
         
+    script_paths = []
     for script_name, script_content in scripts.items():
         script_path = f"{SERVER_PATH}/bin/{script_name}"
         with open(script_path, 'w') as f:
             f.write(script_content)
-        run_command(f"chmod 755 {script_path}", use_sudo=True)
-        run_command(f"chown dst:dst {script_path}", use_sudo=True)
+        script_paths.append(script_path)
+    set_ownership(script_paths, 'dst', 0o755)
     
     logger.info("Shell脚本设置完成")
     return True
@@ -295,320 +694,2756 @@ screen -S dst_server2 -X quit > /dev/null 2>&1
 
 
 
-def parse_lua_table(content):
-    def parse_value(value):
-        value = value.strip()
-        if value == "true":
-            return True
-        elif value == "false":
-            return False
-        elif value.isdigit():
-            return int(value)
-        elif value.replace(".", "").isdigit():
-            return float(value)
+LUA_NUMBER_RE = re.compile(r'0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?')
+LUA_NAME_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+LUA_LONG_BRACKET_RE = re.compile(r'\[(=*)\[')
+LUA_ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'a': '\a', 'b': '\b', 'f': '\f', 'v': '\v',
+               '\\': '\\', '"': '"', "'": "'", '\n': '\n'}
+LUA_KEYWORDS = {'true': True, 'false': False, 'nil': None}
+
+def _read_lua_long_bracket(content, pos):
+    # pos 指向 '['，返回 (内容, 结束位置)；不是长括号时返回 None
+    match = LUA_LONG_BRACKET_RE.match(content, pos)
+    if not match:
+        return None
+    close = ']' + match.group(1) + ']'
+    end = content.find(close, match.end())
+    if end == -1:
+        raise ValueError(f"第{pos}个字符处的长字符串没有结束")
+    text = content[match.end():end]
+    if text.startswith('\n'):
+        text = text[1:]
+    return text, end + len(close)
+
+def _read_lua_string(content, pos):
+    quote = content[pos]
+    chars = []
+    i = pos + 1
+    length = len(content)
+    while i < length:
+        ch = content[i]
+        if ch == quote:
+            return ''.join(chars), i + 1
+        if ch == '\n':
+            break
+        if ch != '\\':
+            chars.append(ch)
+            i += 1
+            continue
+        i += 1
+        if i >= length:
+            break
+        ch = content[i]
+        if ch in LUA_ESCAPES:
+            chars.append(LUA_ESCAPES[ch])
+            i += 1
+        elif ch == 'x':
+            chars.append(chr(int(content[i + 1:i + 3], 16)))
+            i += 3
+        elif ch == 'z':
+            i += 1
+            while i < length and content[i].isspace():
+                i += 1
+        elif ch == 'u' and content.startswith('{', i + 1):
+            close = content.index('}', i)
+            chars.append(chr(int(content[i + 2:close], 16)))
+            i = close + 1
+        elif ch.isdigit():
+            digits = re.match(r'\d{1,3}', content[i:i + 3]).group()
+            chars.append(chr(int(digits)))
+            i += len(digits)
         else:
-            return value.strip('"')
+            raise ValueError(f"第{i}个字符处有无效的转义序列")
+    raise ValueError(f"第{pos}个字符处的字符串没有结束")
 
-    result = {}
-    current_table = result
-    table_stack = []
-    current_key = None
-
-    for line in content.split('\n'):
-        line = line.strip()
-        if line.startswith('[') and line.endswith('] = {'):
-            key = line[1:-4].strip('[]" ')
-            current_table[key] = {}
-            table_stack.append((current_table, current_key))
-            current_table = current_table[key]
-            current_key = None
-        elif line == '},':
-            if table_stack:
-                current_table, current_key = table_stack.pop()
-        elif '=' in line:
-            key, value = line.split('=', 1)
-            key = key.strip('[] "')
-            value = value.strip('," ')
-            if value == '{':
-                current_table[key] = {}
-                table_stack.append((current_table, current_key))
-                current_table = current_table[key]
-                current_key = key
+def tokenize_lua(content):
+    # 单遍扫描，产生 (类型, 值, 位置) 三元组
+    tokens = []
+    i = 0
+    length = len(content)
+    while i < length:
+        ch = content[i]
+        if ch.isspace():
+            i += 1
+        elif content.startswith('--', i):
+            long_comment = _read_lua_long_bracket(content, i + 2) if content.startswith('[', i + 2) else None
+            if long_comment:
+                i = long_comment[1]
             else:
-                current_table[key] = parse_value(value)
+                newline = content.find('\n', i)
+                i = length if newline == -1 else newline + 1
+        elif ch in '"\'':
+            value, i_end = _read_lua_string(content, i)
+            tokens.append(('string', value, i))
+            i = i_end
+        elif ch == '[' and content.startswith(('[[', '[='), i):
+            value, i_end = _read_lua_long_bracket(content, i)
+            tokens.append(('string', value, i))
+            i = i_end
+        elif ch.isdigit() or (ch == '.' and i + 1 < length and content[i + 1].isdigit()):
+            match = LUA_NUMBER_RE.match(content, i)
+            text = match.group()
+            if text[:2] in ('0x', '0X'):
+                value = int(text, 16)
+            elif any(c in text for c in '.eE'):
+                value = float(text)
+            else:
+                value = int(text)
+            tokens.append(('number', value, i))
+            i = match.end()
+        elif ch.isalpha() or ch == '_':
+            match = LUA_NAME_RE.match(content, i)
+            tokens.append(('name', match.group(), i))
+            i = match.end()
+        elif ch in '{}[]=,;-':
+            tokens.append(('op', ch, i))
+            i += 1
+        else:
+            raise ValueError(f"第{i}个字符处有无法识别的字符: {ch!r}")
+    tokens.append(('eof', None, length))
+    return tokens
 
-    return result
+class _LuaTableParser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self, offset=0):
+        return self.tokens[min(self.pos + offset, len(self.tokens) - 1)]
 
-def read_modoverrides():
-    modoverrides_path = f"{CONFIG_PATH}/Master/modoverrides.lua"
-    if not os.path.exists(modoverrides_path):
+    def next(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def expect(self, value):
+        token = self.next()
+        if token[0] != 'op' or token[1] != value:
+            raise ValueError(f"第{token[2]}个字符处应为 '{value}'")
+        return token
+
+    def parse_value(self):
+        kind, value, position = self.next()
+        if kind in ('string', 'number'):
+            return value
+        if kind == 'name' and value in LUA_KEYWORDS:
+            return LUA_KEYWORDS[value]
+        if kind == 'op' and value == '-':
+            number = self.next()
+            if number[0] != 'number':
+                raise ValueError(f"第{number[2]}个字符处应为数字")
+            return -number[1]
+        if kind == 'op' and value == '{':
+            self.pos -= 1
+            return self.parse_table()
+        raise ValueError(f"第{position}个字符处有无法解析的值")
+
+    def parse_table(self):
+        self.expect('{')
+        fields = {}
+        array = []
+        while not (self.peek()[0] == 'op' and self.peek()[1] == '}'):
+            kind, value, position = self.peek()
+            if kind == 'op' and value == '[':
+                self.next()
+                key = self.parse_value()
+                self.expect(']')
+                self.expect('=')
+                fields[key] = self.parse_value()
+            elif kind == 'name' and self.peek(1)[:2] == ('op', '='):
+                self.pos += 2
+                fields[value] = self.parse_value()
+            elif kind == 'eof':
+                raise ValueError("表没有结束")
+            else:
+                array.append(self.parse_value())
+            separator = self.peek()
+            if separator[0] == 'op' and separator[1] in ',;':
+                self.next()
+            elif not (separator[0] == 'op' and separator[1] == '}'):
+                raise ValueError(f"第{separator[2]}个字符处应为 ',' 或 '}}'")
+        self.expect('}')
+        if array and not fields:
+            return array
+        for index, value in enumerate(array, 1):
+            fields[index] = value
+        # JSON 只支持字符串键
+        return {k if isinstance(k, str) else str(k): v for k, v in fields.items()}
+
+def parse_lua_table(content):
+    parser = _LuaTableParser(tokenize_lua(content))
+    if parser.peek()[:2] == ('name', 'return'):
+        parser.next()
+    if parser.peek()[0] == 'eof':
         return {}
-    
-    with open(modoverrides_path, 'r') as f:
-        content = f.read()
-    
-    # 移除 'return' 并解析Lua表
-    content = content.replace('return', '').strip()
-    return parse_lua_table(content)
+    result = parser.parse_value()
+    if parser.peek()[0] != 'eof':
+        raise ValueError(f"第{parser.peek()[2]}个字符处有多余的内容")
+    return result
+
+# 已解析的 modoverrides，按 (路径, mtime, 大小) 缓存；调用方不要修改返回值
+_modoverrides_cache = {}
+_modoverrides_lock = threading.Lock()
+
+def modoverrides_path(cluster=DEFAULT_CLUSTER):
+    shard = master_shard(cluster)
+    shard_path = shard['path'] if shard else f"{cluster_path(cluster)}/Master"
+    return f"{shard_path}/modoverrides.lua"
+
+def read_modoverrides_versioned(cluster=DEFAULT_CLUSTER):
+    # 返回 (mods, 版本号)；版本号为主分片 modoverrides.lua 的 mtime（微秒，前端 JS 也能精确表示），文件不存在时为 0
+    path = modoverrides_path(cluster)
+    try:
+        file_stat = os.stat(path)
+    except FileNotFoundError:
+        return {}, 0
+
+    key = (file_stat.st_mtime_ns, file_stat.st_size)
+    with _modoverrides_lock:
+        cached = _modoverrides_cache.get(path)
+        record_cache('modoverrides', bool(cached and cached[0] == key))
+        if cached and cached[0] == key:
+            return cached[1], file_stat.st_mtime_ns // 1000
+
+    with open(path, 'r', encoding='utf-8') as f:
+        mods = parse_lua_table(f.read())
+    if not isinstance(mods, dict):
+        mods = {}
+
+    with _modoverrides_lock:
+        _modoverrides_cache[path] = (key, mods)
+    return mods, file_stat.st_mtime_ns // 1000
+
+def read_modoverrides(cluster=DEFAULT_CLUSTER):
+    return read_modoverrides_versioned(cluster)[0]
+
+def render_modoverrides(mods):
+    def lua_string(value):
+        escaped = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n').replace('\r', '\\r')
+        return f'"{escaped}"'
+
+    def lua_key(key):
+        key = str(key)
+        if LUA_NAME_RE.fullmatch(key) and key not in LUA_KEYWORDS and key != 'return':
+            return key
+        return f'[{lua_string(key)}]'
 
-def write_modoverrides(mods):
-    def lua_repr(value):
+    def lua_repr(value, indent):
         if isinstance(value, bool):
             return str(value).lower()
+        elif value is None:
+            return 'nil'
         elif isinstance(value, (int, float)):
             return str(value)
         elif isinstance(value, str):
-            return f'"{value}"'
+            return lua_string(value)
+        elif isinstance(value, list):
+            return '{ ' + ', '.join(lua_repr(item, indent) for item in value) + ' }'
+        elif isinstance(value, dict):
+            return '{\n' + '\n'.join(format_table(value, indent + 1)) + f'\n{"  " * indent}}}'
         else:
-            return str(value)
+            return lua_string(str(value))
 
     def format_table(table, indent=0):
         lines = []
         for key, value in table.items():
             if isinstance(value, dict):
-                lines.append(f'{"  " * indent}["{key}"] = {{')
+                lines.append(f'{"  " * indent}[{lua_string(str(key))}] = {{')
                 lines.extend(format_table(value, indent + 1))
                 lines.append(f'{"  " * indent}}},')
             else:
-                lines.append(f'{"  " * indent}{key} = {lua_repr(value)},')
+                lines.append(f'{"  " * indent}{lua_key(key)} = {lua_repr(value, indent)},')
         return lines
 
-    modoverrides_path = f"{CONFIG_PATH}/Master/modoverrides.lua"
-    
-    with open(modoverrides_path, 'w') as f:
-        f.write("return {\n")
-        f.write('\n'.join(format_table(mods, 1)))
-        f.write("}\n")
-
-def update_mod_configuration():
-    mods = read_modoverrides()
-    mod_setup_path = f"{SERVER_PATH}/mods/dedicated_server_mods_setup.lua"
-    
+    return "return {\n" + '\n'.join(format_table(mods, 1)) + "\n}\n"
+
+# 修改 modoverrides 时的读-比较-写需要串行执行
+_modoverrides_write_lock = threading.Lock()
+
+def write_modoverrides(mods, cluster=DEFAULT_CLUSTER):
+    # 所有分片的 modoverrides.lua 必须一致：先全部写入临时文件，再逐个 rename 替换。
+    # 返回新的版本号，保证严格大于旧版本（mtime 精度不足时手动推进）
+    content = render_modoverrides(mods)
+    master_path = modoverrides_path(cluster)
+    paths = [f"{shard['path']}/modoverrides.lua" for shard in cluster_shards(cluster)]
+    if master_path not in paths:
+        paths.insert(0, master_path)
     try:
-        with open(mod_setup_path, 'w') as f:
-            f.write("-- 这个文件由服务器自动生成，请勿手动修改\n\n")
-            for mod_id in mods.keys():
-                # 提取 workshop ID
-                workshop_id = mod_id.split('-')[-1]
-                f.write(f'ServerModSetup("{workshop_id}")\n')
-        
-        logger.info("MOD配置已更新")
-    except Exception as e:
-        logger.error(f"更新MOD配置时出错: {str(e)}")
-        raise
+        previous = os.stat(master_path).st_mtime_ns // 1000
+    except FileNotFoundError:
+        previous = 0
 
-# 修改start_server函数
-def start_server(shard):
-    logger.info(f"正在启动{shard}服务器...")
-    
-    update_mod_configuration()
-    
-    script_name = 'restart.sh' if shard == 'overworld' else 'restart2.sh'
-    command = f"sh {SERVER_PATH}/bin/{script_name}"
-    output, error = run_command(command, user='dst')
+    for path in paths:
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            f.write(content)
+    for path in paths:
+        os.replace(f"{path}.tmp", path)
+    mtime_ns = os.stat(master_path).st_mtime_ns
+    if mtime_ns // 1000 <= previous:
+        mtime_ns = (previous + 1) * 1000
+        os.utime(master_path, ns=(mtime_ns, mtime_ns))
+    set_ownership(paths, 'dst')
+    # 写入的内容就是解析结果，直接放入缓存，下次读取不用重新解析
+    with _modoverrides_lock:
+        _modoverrides_cache[master_path] = ((mtime_ns, len(content.encode('utf-8'))), copy.deepcopy(mods))
+    return mtime_ns // 1000
+
+def merge_patch(target, patch):
+    # JSON Merge Patch (RFC 7396)：对象递归合并，null 表示删除该键
+    if not isinstance(patch, dict):
+        return patch
+    if not isinstance(target, dict):
+        target = {}
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        else:
+            target[key] = merge_patch(target.get(key), value)
+    return target
+
+def patch_modoverrides(patch, cluster=DEFAULT_CLUSTER, expected_version=None):
+    # 返回 (mods, 版本号, 是否冲突)；版本不一致时不写入，返回当前内容和版本
+    with _modoverrides_write_lock:
+        mods, version = read_modoverrides_versioned(cluster)
+        if expected_version is not None and expected_version != version:
+            return mods, version, True
+        # 缓存中的表是共享的，修改前先复制
+        mods = merge_patch(copy.deepcopy(mods), patch)
+        version = write_modoverrides(mods, cluster)
+    return mods, version, False
+
+def write_file_atomic(path, content):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(temp_path, path)
+
+def load_mod_manifest():
+    try:
+        with open(MOD_MANIFEST_PATH, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    manifest.setdefault('mods', {})
+    return manifest
+
+def ugc_mod_paths():
+    # 新版UGC MOD在 ugc_mods/<集群>/<分片>/content/322330/<id>，一次扫描得到 {id: modinfo.lua 路径}
+    paths = {}
+    for path in glob.glob(f"{SERVER_PATH}/ugc_mods/*/*/content/322330/*/modinfo.lua"):
+        paths.setdefault(os.path.basename(os.path.dirname(path)), path)
+    return paths
+
+def installed_mod_version(workshop_id, ugc_paths=None):
+    # 旧版MOD在 mods/workshop-<id>，新版UGC MOD见 ugc_mod_paths
+    if ugc_paths is None:
+        ugc_paths = ugc_mod_paths()
+    candidates = [f"{SERVER_PATH}/mods/workshop-{workshop_id}/modinfo.lua"]
+    if workshop_id in ugc_paths:
+        candidates.append(ugc_paths[workshop_id])
+    for path in candidates:
+        try:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                match = MOD_VERSION_RE.search(f.read())
+            return match.group(1) if match else ''
+        except OSError:
+            continue
+    return None
+
+def configured_workshop_ids():
+    # 所有集群共用一个服务器目录，需要下载所有集群用到的MOD
+    workshop_ids = set()
+    for cluster in get_clusters():
+        # 某个集群的 modoverrides.lua 有语法错误时不影响其他集群
+        try:
+            mod_ids = read_modoverrides(cluster)
+        except ValueError as e:
+            logger.error(f"解析集群{cluster}的modoverrides.lua时出错，已跳过: {e}")
+            continue
+        for mod_id in mod_ids:
+            if mod_id.startswith('workshop-'):
+                workshop_ids.add(mod_id.split('-', 1)[1])
+    return sorted(workshop_ids)
+
+def prefetch_mods():
+    # 用服务器自带的 -only_update_server_mods 下载 setup 文件中的MOD后退出
+    command = [f'./{DST_BINARY}', '-only_update_server_mods']
+    output, error = run_command(command, user='dst', timeout=STEAMCMD_TIMEOUT, cwd=f'{SERVER_PATH}/bin')
     if error:
-        logger.error(f"启动{shard}服务器时出错: {error}")
+        logger.error(f"下载MOD时出错: {error}")
         return False
     return True
 
-def stop_server(shard):
-    logger.info(f"正在停止{shard}服务器...")
-    server_name = 'dst_server1' if shard == 'overworld' else 'dst_server2'
-    command = f"screen -S {server_name} -X quit"
-    output, error = run_command(command, user='dst')
-    if error:
-        logger.error(f"停止{shard}服务器时出错: {error}")
+_mod_sync_lock = threading.Lock()
+
+def update_mod_configuration(force=False):
+    # 只有MOD集合变化时才重写 setup 文件，只有出现未下载的MOD时才预先下载一次；
+    # 返回是否所有MOD都已就绪
+    with _mod_sync_lock:
+        workshop_ids = configured_workshop_ids()
+        content = "-- 这个文件由服务器自动生成，请勿手动修改\n\n"
+        content += ''.join(f'ServerModSetup("{workshop_id}")\n' for workshop_id in workshop_ids)
+
+        try:
+            with open(MOD_SETUP_PATH, 'r', encoding='utf-8') as f:
+                current = f.read()
+        except OSError:
+            current = None
+        try:
+            if current != content:
+                # 更新服务器时 validate 会还原这个文件，所以和实际内容比较而不是和清单比较
+                write_file_atomic(MOD_SETUP_PATH, content)
+                logger.info("MOD配置已更新")
+        except Exception as e:
+            logger.error(f"更新MOD配置时出错: {str(e)}")
+            raise
+
+        manifest = load_mod_manifest()
+        # 清单只记录已下载的版本，无法得知创意工坊上是否有新版本，定期整体重新下载一次
+        checked = manifest.get('checked', 0)
+        if MOD_REFRESH_INTERVAL and time.time() - checked >= MOD_REFRESH_INTERVAL:
+            force = True
+        ugc_paths = ugc_mod_paths()
+        missing = [workshop_id for workshop_id in workshop_ids
+                   if force or workshop_id not in manifest['mods'] or installed_mod_version(workshop_id, ugc_paths) is None]
+        success = True
+        if missing:
+            logger.info(f"正在下载{len(missing)}个MOD...")
+            success = prefetch_mods()
+            if success and force:
+                manifest['checked'] = time.time()
+            ugc_paths = ugc_mod_paths()
+
+        mods = {}
+        for workshop_id in workshop_ids:
+            version = installed_mod_version(workshop_id, ugc_paths)
+            if version is not None:
+                previous = manifest['mods'].get(workshop_id, {})
+                mods[workshop_id] = {
+                    'version': version,
+                    'updated': previous.get('updated') if previous.get('version') == version else time.time()
+                }
+        if mods != manifest['mods'] or manifest.get('checked', 0) != checked:
+            manifest['mods'] = mods
+            write_file_atomic(MOD_MANIFEST_PATH, json.dumps(manifest, indent=2))
+        return success and len(mods) == len(workshop_ids)
+
+def cluster_path(cluster):
+    return CONFIG_PATH if cluster == DEFAULT_CLUSTER else f'{KLEI_ROOT}/{cluster}'
+
+def _read_shard(cluster, shard_dir, path):
+    parser = configparser.ConfigParser()
+    parser.read(f'{path}/server.ini')
+    screen_name = LEGACY_SCREEN_NAMES.get(shard_dir) if cluster == DEFAULT_CLUSTER else None
+    return {
+        'cluster': cluster,
+        'shard': shard_dir,
+        'name': parser.get('SHARD', 'name', fallback=shard_dir),
+        'is_master': parser.getboolean('SHARD', 'is_master', fallback=shard_dir == 'Master'),
+        'server_port': parser.getint('NETWORK', 'server_port', fallback=None),
+        'path': path,
+        'screen': screen_name or f'dst_{cluster}_{shard_dir}'
+    }
+
+def _load_cluster(cluster, path):
+    shards = {}
+    try:
+        entries = sorted(os.listdir(path))
+    except OSError:
+        entries = []
+    for entry in entries:
+        shard_path = os.path.join(path, entry)
+        if not os.path.isfile(os.path.join(shard_path, 'server.ini')):
+            continue
+        try:
+            shards[entry] = _read_shard(cluster, entry, shard_path)
+        except (configparser.Error, ValueError) as e:
+            logger.warning(f"读取{cluster}/{entry}的server.ini时出错: {str(e)}")
+    return {'name': cluster, 'path': path, 'shards': shards}
+
+def discover_clusters():
+    # 每个含有 cluster.ini 的目录是一个集群，其中含有 server.ini 的子目录是分片
+    clusters = {}
+    try:
+        names = sorted(os.listdir(KLEI_ROOT))
+    except OSError:
+        names = []
+    for name in names:
+        path = cluster_path(name)
+        if os.path.isfile(os.path.join(path, 'cluster.ini')):
+            clusters[name] = _load_cluster(name, path)
+
+    if DEFAULT_CLUSTER not in clusters or not clusters[DEFAULT_CLUSTER]['shards']:
+        # 默认集群还没有配置时仍按 Master/Caves 管理，兼容原有接口
+        default = {'name': DEFAULT_CLUSTER, 'path': CONFIG_PATH, 'shards': {}}
+        for shard_dir in SHARD_ALIASES.values():
+            default['shards'][shard_dir] = _read_shard(DEFAULT_CLUSTER, shard_dir, f'{CONFIG_PATH}/{shard_dir}')
+        clusters[DEFAULT_CLUSTER] = default
+    return clusters
+
+_cluster_cache = {'time': 0.0, 'data': None}
+_cluster_lock = threading.Lock()
+
+def get_clusters(force=False):
+    with _cluster_lock:
+        now = time.monotonic()
+        stale = force or _cluster_cache['data'] is None or now - _cluster_cache['time'] >= CLUSTER_CACHE_TTL
+        record_cache('clusters', not stale)
+        if stale:
+            _cluster_cache['data'] = discover_clusters()
+            _cluster_cache['time'] = time.monotonic()
+        return _cluster_cache['data']
+
+def invalidate_cluster_cache():
+    with _cluster_lock:
+        _cluster_cache['data'] = None
+
+def get_cluster(cluster):
+    return get_clusters().get(cluster)
+
+def get_shard(cluster, shard):
+    cluster_info = get_cluster(cluster)
+    if cluster_info is None:
+        return None
+    return cluster_info['shards'].get(SHARD_ALIASES.get(shard, shard))
+
+def cluster_shards(cluster=None):
+    clusters = get_clusters()
+    names = [cluster] if cluster else list(clusters)
+    return [shard for name in names if name in clusters for shard in clusters[name]['shards'].values()]
+
+def master_shard(cluster):
+    shards = cluster_shards(cluster)
+    for shard in shards:
+        if shard['is_master']:
+            return shard
+    return shards[0] if shards else None
+
+# 已解析并翻译成中文标签的 cluster.ini，按 (路径, mtime, 大小) 缓存；调用方不要修改返回值
+_config_cache = {}
+_config_lock = threading.Lock()
+
+def cluster_config_path(cluster=DEFAULT_CLUSTER):
+    return f'{cluster_path(cluster)}/cluster.ini'
+
+def _config_etag(file_stat):
+    return f'{file_stat.st_mtime_ns:x}-{file_stat.st_size:x}'
+
+def _parse_cluster_config(path):
+    parser = configparser.ConfigParser()
+    parser.read(path)
+    return {
+        config_mapping.get(section, section): {
+            config_mapping.get(key, key): value for key, value in parser[section].items()
+        }
+        for section in parser.sections()
+    }
+
+def read_cluster_config(cluster=DEFAULT_CLUSTER):
+    # 返回 (翻译后的配置, ETag)；文件不存在时返回 ({}, None)
+    path = cluster_config_path(cluster)
+    try:
+        file_stat = os.stat(path)
+    except FileNotFoundError:
+        return {}, None
+
+    etag = _config_etag(file_stat)
+    with _config_lock:
+        cached = _config_cache.get(path)
+        record_cache('cluster_config', bool(cached and cached[0] == etag))
+        if cached and cached[0] == etag:
+            return cached[1], etag
+
+    translated = _parse_cluster_config(path)
+    with _config_lock:
+        _config_cache[path] = (etag, translated)
+    return translated, etag
+
+def validate_config_value(key, value):
+    # 按 CONFIG_SCHEMA 校验并规范化为 cluster.ini 中的写法，返回 (值, 错误)
+    kind = CONFIG_SCHEMA.get(key, 'str')
+    text = str(value).strip()
+    if kind == 'bool':
+        if isinstance(value, bool):
+            return str(value).lower(), None
+        if text.lower() in ('true', 'false'):
+            return text.lower(), None
+        return None, f"{key} 必须是 true 或 false"
+    if kind[0] == 'int':
+        try:
+            if isinstance(value, bool):
+                raise ValueError
+            number = int(text)
+        except ValueError:
+            return None, f"{key} 必须是整数"
+        if (kind[1] is not None and number < kind[1]) or (kind[2] is not None and number > kind[2]):
+            return None, f"{key} 必须在 {kind[1]} 到 {kind[2] if kind[2] is not None else '∞'} 之间"
+        return str(number), None
+    if kind[0] == 'choice':
+        if text not in kind[1]:
+            return None, f"{key} 必须是 {', '.join(kind[1])} 之一"
+        return text, None
+    if '\n' in text or '\r' in text:
+        return None, f"{key} 不能包含换行"
+    return str(value), None
+
+def write_cluster_config(changes, cluster=DEFAULT_CLUSTER, if_match=None):
+    # changes 为 {分区: {字段: 值}}，分区和字段可以是中文标签。先整体校验，再写临时文件后 rename。
+    # if_match 为调用方读取时的 ETag，文件已被他人修改时返回 (None, 'conflict')
+    # 返回 (新 ETag, 错误列表)
+    updates = []
+    errors = []
+    for section, options in changes.items():
+        if not isinstance(options, dict):
+            errors.append(f"{section} 必须是对象")
+            continue
+        original_section = reverse_mapping.get(section, section)
+        for key, value in options.items():
+            original_key = reverse_mapping.get(key, key).lower()
+            normalized, error = validate_config_value(original_key, value)
+            if error:
+                errors.append(error)
+            else:
+                updates.append((original_section, original_key, normalized))
+    if errors:
+        return None, errors
+
+    path = cluster_config_path(cluster)
+    with _config_lock:
+        try:
+            current_etag = _config_etag(os.stat(path))
+        except FileNotFoundError:
+            current_etag = None
+        if if_match is not None and if_match != current_etag:
+            return None, 'conflict'
+
+        parser = configparser.ConfigParser()
+        parser.read(path)
+        for section, key, value in updates:
+            if section not in parser:
+                parser[section] = {}
+            parser[section][key] = value
+        buffer = io.StringIO()
+        parser.write(buffer)
+        write_file_atomic(path, buffer.getvalue())
+        set_ownership([path], 'dst')
+        return _config_etag(os.stat(path)), []
+
+_status_cache = {'time': 0.0, 'data': None}
+_status_lock = threading.Lock()
+
+def scan_shard_processes():
+    # 直接扫描 /proc 中的 DST 进程，不需要 fork 任何子进程，返回 {(集群, 分片): pid}
+    try:
+        pids = [pid for pid in os.listdir('/proc') if pid.isdigit()]
+    except OSError:
+        return None
+
+    running = {}
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                args = f.read().decode('utf-8', 'replace').split('\0')
+        except OSError:
+            continue
+        if not args or DST_BINARY not in os.path.basename(args[0]):
+            continue
+        options = dict(zip(args[1:], args[2:]))
+        # DST 未指定参数时的默认值
+        running[(options.get('-cluster', 'Cluster_1'), options.get('-shard', 'Master'))] = int(pid)
+    return running
+
+def probe_shard_processes():
+    processes = scan_shard_processes()
+    return None if processes is None else set(processes)
+
+def probe_screen_sessions():
+    output, error = run_command("screen -list", user='dst')
+    if error and not output:
+        logger.error(f"检查服务器状态时出错: {error}")
+        return set()
+    return set(re.findall(r'^\s+\d+\.(\S+)', output, re.MULTILINE))
+
+def probe_server_status():
+    shards = cluster_shards()
+    running = probe_shard_processes()
+    if running is None:
+        # 没有 /proc 时退回到一次 screen -list 查询
+        sessions = probe_screen_sessions()
+        return {(shard['cluster'], shard['shard']): shard['screen'] in sessions for shard in shards}
+    return {(shard['cluster'], shard['shard']): (shard['cluster'], shard['shard']) in running for shard in shards}
+
+def get_server_status(force=False):
+    with _status_lock:
+        now = time.monotonic()
+        stale = force or _status_cache['data'] is None or now - _status_cache['time'] >= STATUS_CACHE_TTL
+        record_cache('status', not stale)
+        if stale:
+            _status_cache['data'] = probe_server_status()
+            _status_cache['time'] = time.monotonic()
+        return dict(_status_cache['data'])
+
+def invalidate_status_cache():
+    with _status_lock:
+        _status_cache['data'] = None
+
+def check_server_status(shard, cluster=DEFAULT_CLUSTER):
+    shard_info = get_shard(cluster, shard)
+    if shard_info is None:
         return False
-    return True
+    return get_server_status().get((cluster, shard_info['shard']), False)
 
-def start_all_server():
-    logger.info("正在启动所有服务器...")
-    
-    # 更新MOD配置
-    update_mod_configuration()
+def shard_log_path(shard_info):
+    return f"{shard_info['path']}/server_log.txt"
+
+_shard_executor = ThreadPoolExecutor(max_workers=SHARD_WORKERS, thread_name_prefix='dst-shard')
+
+def fan_out(function, shards, **kwargs):
+    # 对多个分片并行执行 function(shard, cluster)，返回 {(集群, 分片): 结果}
+    futures = {
+        (shard['cluster'], shard['shard']): _shard_executor.submit(function, shard['shard'], shard['cluster'], **kwargs)
+        for shard in shards
+    }
+    return {key: future.result() for key, future in futures.items()}
+
+def start_server(shard, cluster=DEFAULT_CLUSTER, update_mods=True, mods_ready=True):
+    shard_info = get_shard(cluster, shard)
+    if shard_info is None:
+        logger.error(f"分片{cluster}/{shard}不存在")
+        return False
+    logger.info(f"正在启动{cluster}/{shard_info['shard']}服务器...")
     
-    command = f"sh {SERVER_PATH}/bin/start_all.sh"
-    output, error = run_command(command, user='dst')
+    if update_mods:
+        mods_ready = update_mod_configuration()
+
+    if check_server_status(shard_info['shard'], cluster):
+        run_command(['screen', '-S', shard_info['screen'], '-X', 'quit'], user='dst')
+    command = ['screen', '-dmS', shard_info['screen'], f'./{DST_BINARY}', '-console',
+               '-cluster', cluster, '-shard', shard_info['shard']]
+    # MOD已在启动前统一下载时分片不再逐个检查；下载失败则交给分片启动时自行更新
+    if mods_ready:
+        command.append('-skip_update_server_mods')
+    else:
+        logger.warning(f"MOD未能全部就绪，{cluster}/{shard_info['shard']}将在启动时自行更新MOD")
+    output, error = run_command(command, user='dst', cwd=f'{SERVER_PATH}/bin')
+    invalidate_status_cache()
     if error:
-        logger.error(f"启动所有服务器时出错: {error}")
+        logger.error(f"启动{cluster}/{shard_info['shard']}服务器时出错: {error}")
         return False
     return True
 
-def stop_all_server():
-    logger.info(f"正在停止所有服务器...")
-    command = f"sh {SERVER_PATH}/bin/stop_all.sh"
+def stop_server(shard, cluster=DEFAULT_CLUSTER):
+    shard_info = get_shard(cluster, shard)
+    if shard_info is None:
+        logger.error(f"分片{cluster}/{shard}不存在")
+        return False
+    logger.info(f"正在停止{cluster}/{shard_info['shard']}服务器...")
+    command = ['screen', '-S', shard_info['screen'], '-X', 'quit']
     output, error = run_command(command, user='dst')
+    invalidate_status_cache()
     if error:
-        logger.error(f"停止所有服务器时出错: {error}")
+        logger.error(f"停止{cluster}/{shard_info['shard']}服务器时出错: {error}")
         return False
     return True
 
-def update_server():
-    logger.info("正在更新服务器...")
-    stop_server('overworld')
-    stop_server('caves')
-    command = f"{STEAMCMD_PATH} +login anonymous +force_install_dir {SERVER_PATH} +app_update 343050 validate +quit"
-    output, error = run_command(command, user='dst')
+def log_position(shard):
+    # (inode, 大小)：DST 启动时会重写日志，据此判断是否需要从头读取
+    try:
+        log_stat = os.stat(shard_log_path(shard))
+        return log_stat.st_ino, log_stat.st_size
+    except OSError:
+        return None, 0
+
+def advance_log(shard, position):
+    # 读取分片日志在 position=(inode, 偏移) 之后新增的完整行，返回 (数据, 新位置, 是否被重写)
+    inode, offset = position or (None, 0)
+    current_inode, size = log_position(shard)
+    rewritten = position is not None and (current_inode != inode or size < offset)
+    if rewritten:
+        offset = 0
+    try:
+        data, offset, size = read_log_from(shard_log_path(shard), offset)
+    except OSError:
+        return b'', position, False
+    return data, (current_inode, offset), rewritten
+
+def wait_for_ready(shards, positions, started_at, timeout):
+    # 单线程轮询所有分片的日志，返回 {(集群, 分片): 就绪耗时}
+    pending = {(shard['cluster'], shard['shard']): shard for shard in shards}
+    ready = {}
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        progressed = False
+        for key, shard in list(pending.items()):
+            data, positions[key], rewritten = advance_log(shard, positions.get(key, (None, 0)))
+            progressed = progressed or bool(data)
+            if any(marker in data for marker in READY_MARKERS):
+                ready[key] = round(time.monotonic() - started_at[key], 3)
+                logger.info(f"{key[0]}/{key[1]}服务器已就绪，耗时{ready[key]}秒")
+                del pending[key]
+        if pending and not progressed:
+            time.sleep(READY_POLL_INTERVAL)
+    for key in pending:
+        logger.warning(f"{key[0]}/{key[1]}服务器未在{timeout}秒内就绪")
+    return ready
+
+def start_shards(shards, ready_timeout=None):
+    # 同时启动所有分片；指定 ready_timeout 时等待日志中的就绪标记
+    shards = list(shards)
+    # 更新MOD配置，所有分片共用一次
+    mods_ready = update_mod_configuration()
+
+    positions = {(shard['cluster'], shard['shard']): log_position(shard) for shard in shards}
+    started_at = {}
+    def launch(shard, cluster):
+        started_at[(cluster, shard)] = time.monotonic()
+        return start_server(shard, cluster, update_mods=False, mods_ready=mods_ready)
+
+    started = fan_out(launch, shards)
+    launched = [shard for shard in shards if started[(shard['cluster'], shard['shard'])]]
+    ready = wait_for_ready(launched, positions, started_at, ready_timeout) if ready_timeout and launched else {}
+    return {
+        key: {"started": ok, "ready": key in ready, "ready_seconds": ready.get(key)}
+        for key, ok in started.items()
+    }
+
+def start_all_server(cluster=DEFAULT_CLUSTER, ready_timeout=None):
+    logger.info(f"正在启动{cluster}的所有服务器...")
+    return start_shards(cluster_shards(cluster), ready_timeout)
+
+def request_shutdown(shard, cluster=DEFAULT_CLUSTER):
+    shard_info = get_shard(cluster, shard)
+    logger.info(f"正在通知{cluster}/{shard_info['shard']}存档并关闭...")
+    result = send_console_commands(shard_info, [SHUTDOWN_COMMAND])
+    return bool(result and result['sent'])
+
+def stop_shards(shards, graceful=True, timeout=SHUTDOWN_TIMEOUT):
+    # 先并行向所有运行中的分片发送关闭命令，再通过进程探测等待退出；
+    # 超过期限或发送失败的分片改为强制结束。返回 {(集群, 分片): {stopped, graceful, shutdown_seconds}}
+    shards = list(shards)
+    status = get_server_status(force=True)
+    running = [shard for shard in shards if status.get((shard['cluster'], shard['shard']))]
+    results = {
+        (shard['cluster'], shard['shard']): {'stopped': True, 'graceful': None, 'shutdown_seconds': 0.0}
+        for shard in shards if shard not in running
+    }
+    started_at = time.monotonic()
+
+    forced = running
+    if graceful and running:
+        sent = fan_out(request_shutdown, running)
+        pending = {key for key, ok in sent.items() if ok}
+        deadline = started_at + timeout
+        while pending:
+            status = get_server_status(force=True)
+            elapsed = round(time.monotonic() - started_at, 3)
+            for key in [key for key in pending if not status.get(key)]:
+                results[key] = {'stopped': True, 'graceful': True, 'shutdown_seconds': elapsed}
+                pending.discard(key)
+            if not pending or time.monotonic() >= deadline:
+                break
+            time.sleep(SHUTDOWN_POLL_INTERVAL)
+        forced = [shard for shard in running if (shard['cluster'], shard['shard']) not in results]
+        for shard in forced:
+            logger.warning(f"{shard['cluster']}/{shard['shard']}未能在{timeout:g}秒内正常关闭，强制停止")
+
+    if forced:
+        killed = fan_out(stop_server, forced)
+        elapsed = round(time.monotonic() - started_at, 3)
+        for key, ok in killed.items():
+            results[key] = {'stopped': ok, 'graceful': False, 'shutdown_seconds': elapsed}
+    invalidate_status_cache()
+    return results
+
+def stop_all_server(cluster=DEFAULT_CLUSTER, graceful=True, timeout=SHUTDOWN_TIMEOUT):
+    logger.info(f"正在停止{cluster}的所有服务器...")
+    return stop_shards(cluster_shards(cluster), graceful, timeout)
+
+# 更新前正在运行的分片，更新完成后重新启动
+_update_restart_shards = []
+
+def stop_shards_for_update():
+    status = get_server_status(force=True)
+    running = [shard for shard in cluster_shards() if status.get((shard['cluster'], shard['shard']))]
+    _update_restart_shards[:] = [(shard['cluster'], shard['shard']) for shard in running]
+    return all(result['stopped'] for result in stop_shards(running).values())
+
+def update_dst_server(validate=False):
+    # validate 会重新校验整个安装目录，只在需要修复文件时使用
+    command = [STEAMCMD_PATH, '+login', 'anonymous', '+force_install_dir', SERVER_PATH, '+app_update', DST_APP_ID]
+    if validate:
+        command.append('validate')
+    output, error = run_command(command + ['+quit'], user='dst', timeout=STEAMCMD_TIMEOUT)
     if error:
         logger.error(f"更新服务器时出错: {error}")
         return False
-    start_server('overworld')
-    start_server('caves')
+    with _update_lock:
+        _update_state['installed'] = installed_buildid()
+        _update_state['update_available'] = False
     return True
 
-def check_server_status(shard):
-    command = "screen -list"
-    output, error = run_command(command, user='dst')
+def start_shards_after_update():
+    # 只启动更新前在运行的分片，手动停止的分片保持停止
+    shards = [get_shard(cluster, shard) for cluster, shard in _update_restart_shards]
+    shards = [shard for shard in shards if shard]
+    if not shards:
+        return True
+    results = start_shards(shards)
+    return all(result['started'] for result in results.values())
+
+def parse_vdf(text):
+    # Valve 的 KeyValues 文本格式（appmanifest、app_info_print），忽略引号外的内容
+    root = {}
+    stack = [root]
+    key = None
+    for match in VDF_TOKEN_RE.finditer(text):
+        value, brace = match.groups()
+        if brace == '{':
+            table = {}
+            if key is not None:
+                stack[-1][key] = table
+            stack.append(table)
+            key = None
+        elif brace == '}':
+            if len(stack) > 1:
+                stack.pop()
+            key = None
+        elif key is None:
+            key = value
+        else:
+            stack[-1][key] = value
+            key = None
+    return root
+
+def installed_buildid():
+    try:
+        with open(APP_MANIFEST_PATH, 'r', encoding='utf-8', errors='replace') as f:
+            return parse_vdf(f.read()).get('AppState', {}).get('buildid')
+    except OSError:
+        return None
+
+def latest_buildid():
+    # 返回 (buildid, 错误)
+    # app_info 连同登录信息远超默认保留的输出行数，需要完整输出
+    output, error = run_command(UPDATE_CHECK_COMMAND, user='dst', max_lines=None)
     if error:
-        logger.error(f"检查服务器状态时出错: {error}")
+        return None, error
+    # steamcmd 在 app_info 前会输出登录等信息，从 AppID 开始解析
+    start = output.find(f'"{DST_APP_ID}"')
+    info = parse_vdf(output[start:]).get(DST_APP_ID, {}) if start >= 0 else {}
+    buildid = info.get('depots', {}).get('branches', {}).get(UPDATE_BRANCH, {}).get('buildid')
+    if buildid is None:
+        return None, "无法从 app_info 中解析最新版本"
+    return buildid, None
+
+_update_lock = threading.Lock()
+_update_state = {'installed': None, 'latest': None, 'update_available': None, 'checked': None, 'error': None}
+_update_scheduler = {'thread': None}
+
+def update_status():
+    with _update_lock:
+        return dict(_update_state)
+
+def check_for_update(max_age=0):
+    # 比较已安装和最新的 buildid；max_age 秒内检查过则直接返回上次结果
+    with _update_lock:
+        checked = _update_state['checked']
+        if max_age and checked and time.time() - checked < max_age and not _update_state['error']:
+            return dict(_update_state)
+
+    installed = installed_buildid()
+    latest, error = latest_buildid()
+    with _update_lock:
+        _update_state.update({
+            'installed': installed,
+            'latest': latest,
+            'update_available': None if error else latest != installed,
+            'checked': time.time(),
+            'error': error
+        })
+        if error:
+            logger.error(f"检查更新时出错: {error}")
+        elif latest != installed:
+            logger.info(f"发现新版本: {installed} -> {latest}")
+        return dict(_update_state)
+
+def update_steps(validate=False, force=False):
+    # 先检查版本，没有新版本时后续步骤直接跳过，不停服；validate 或 force 时总是执行更新
+    plan = {'update': validate or force}
+
+    def check():
+        if plan['update']:
+            return True
+        result = check_for_update(max_age=UPDATE_CHECK_CACHE_TTL)
+        if result['error']:
+            return False
+        plan['update'] = result['update_available']
+        if not plan['update']:
+            logger.info(f"已是最新版本({result['installed']})，无需更新")
+        return True
+
+    return [
+        ("检查更新", check),
+        ("停止服务器", lambda: not plan['update'] or stop_shards_for_update()),
+        ("更新DST服务器", lambda: not plan['update'] or update_dst_server(validate)),
+        ("启动服务器", lambda: not plan['update'] or start_shards_after_update())
+    ]
+
+INSTALL_STEPS = [
+    ("安装依赖项", install_dependencies),
+    ("设置DST用户", setup_user),
+    ("安装SteamCMD", install_steamcmd),
+    ("安装DST服务器", install_dst_server),
+    ## ("配置服务器", configure_server),
+    ("设置Shell脚本", setup_shell_scripts)
+]
+
+def update_server(validate=False, force=False):
+    logger.info("正在更新服务器...")
+    for step_name, step_function in update_steps(validate, force):
+        if not step_function():
+            return False
+    return True
+
+def _update_check_loop():
+    while True:
+        time.sleep(UPDATE_CHECK_INTERVAL)
+        try:
+            result = check_for_update()
+            if result['update_available'] and AUTO_UPDATE:
+                job, created = submit_job('update', update_steps(), lock=SERVER_PATH)
+                if created:
+                    logger.info(f"已提交自动更新任务{job['job_id']}")
+        except Exception as e:
+            logger.exception(f"检查服务器更新时出错: {str(e)}")
+
+def ensure_update_scheduler_started():
+    if not UPDATE_CHECK_INTERVAL:
+        return
+    with _update_lock:
+        if _update_scheduler['thread'] is None:
+            thread = threading.Thread(target=_update_check_loop, name='dst-update-check', daemon=True)
+            _update_scheduler['thread'] = thread
+            thread.start()
+
+# 后台任务：安装和更新都会写 SERVER_PATH，同一时间只允许一个运行
+_job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='dst-job')
+_jobs = {}
+_job_locks = {}
+_jobs_lock = threading.Lock()
+
+def _job_view(job):
+    return {
+        "job_id": job['id'],
+        "kind": job['kind'],
+        "status": job['status'],
+        "current_step": job['current_step'],
+        "steps": [dict(step) for step in job['steps']],
+        "error": job['error'],
+        "output": list(job['output']),
+        "created": job['created'],
+        "started": job['started'],
+        "finished": job['finished']
+    }
+
+def get_job(job_id):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return _job_view(job) if job else None
+
+def _prune_jobs():
+    finished = [job for job in _jobs.values() if job['finished'] is not None]
+    finished.sort(key=lambda job: job['finished'])
+    for job in finished[:max(0, len(finished) - JOB_HISTORY_LIMIT)]:
+        del _jobs[job['id']]
+
+def _set_step(job, index, status):
+    with _jobs_lock:
+        job['steps'][index]['status'] = status
+        if status == 'running':
+            job['current_step'] = job['steps'][index]['name']
+
+def _run_job(job, steps):
+    with _jobs_lock:
+        job['status'] = 'running'
+        job['started'] = time.time()
+    final_status, error = 'failed', None
+    _job_context.job = job
+    try:
+        for index, (step_name, step_function) in enumerate(steps):
+            logger.info(f"开始{step_name}...")
+            _set_step(job, index, 'running')
+            if not step_function():
+                _set_step(job, index, 'failed')
+                error = f"{step_name}失败"
+                logger.error(f"任务{job['id']}执行失败: {error}")
+                break
+            _set_step(job, index, 'done')
+            logger.info(f"{step_name}完成")
+        else:
+            final_status = 'done'
+    except Exception as e:
+        logger.exception(f"任务{job['id']}执行时发生异常: {str(e)}")
+        error = str(e)
+    finally:
+        _job_context.job = None
+        with _jobs_lock:
+            job['status'] = final_status
+            job['error'] = error
+            job['finished'] = time.time()
+            if _job_locks.get(job['lock']) == job['id']:
+                del _job_locks[job['lock']]
+            _prune_jobs()
+
+def submit_job(kind, steps, lock=None):
+    # 返回 (任务, 是否新建)；同一锁上已有运行中的任务时返回该任务
+    with _jobs_lock:
+        if lock and lock in _job_locks:
+            return _job_view(_jobs[_job_locks[lock]]), False
+        job = {
+            'id': uuid.uuid4().hex,
+            'kind': kind,
+            'status': 'pending',
+            'current_step': None,
+            'steps': [{'name': step_name, 'status': 'pending'} for step_name, _ in steps],
+            'error': None,
+            'output': deque(maxlen=20),
+            'created': time.time(),
+            'started': None,
+            'finished': None,
+            'lock': lock
+        }
+        _jobs[job['id']] = job
+        if lock:
+            _job_locks[lock] = job['id']
+        view = _job_view(job)
+    _job_executor.submit(_run_job, job, steps)
+    return view, True
+
+def job_response(kind, steps, message, lock=SERVER_PATH):
+    job, created = submit_job(kind, steps, lock=lock)
+    if not created:
+        return jsonify({"状态": "错误", "消息": f"已有{job['kind']}任务正在进行", "job_id": job['job_id'], "job": job}), 409
+    return jsonify({"状态": "成功", "消息": message, "job_id": job['job_id'], "job": job}), 202
+
+# 备份存储：chunks/<前两位>/<sha256> 为压缩后的分块，snapshots/<集群>/<快照ID>.json 为快照清单。
+# 清单记录每个文件的大小、mtime 和分块列表，大小和 mtime 未变的文件直接沿用上一个快照的分块
+_backup_lock = threading.Lock()
+_backup_state = {'pool': None, 'thread': None}
+# 快照、清理、删除和恢复都要读写分块存储，同一时间只允许一个进行
+_backup_store_lock = threading.Lock()
+
+def _backup_pool():
+    with _backup_lock:
+        if _backup_state['pool'] is None:
+            _backup_state['pool'] = ProcessPoolExecutor(max_workers=BACKUP_WORKERS)
+        return _backup_state['pool']
+
+def _compress_chunk(data):
+    return zlib.compress(data, BACKUP_COMPRESS_LEVEL)
+
+def chunk_path(digest):
+    return f'{BACKUP_ROOT}/chunks/{digest[:2]}/{digest}'
+
+def snapshot_path(cluster, snapshot_id):
+    return f'{BACKUP_ROOT}/snapshots/{cluster}/{snapshot_id}.json'
+
+def _store_chunks(batch):
+    # batch 为 [(摘要, 原始数据)]，返回压缩后写入的字节数
+    stored = 0
+    for (digest, _), blob in zip(batch, _backup_pool().map(_compress_chunk, [data for _, data in batch])):
+        path = chunk_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f'{path}.tmp', 'wb') as f:
+            f.write(blob)
+        os.replace(f'{path}.tmp', path)
+        stored += len(blob)
+    return stored
+
+def list_snapshots(cluster=DEFAULT_CLUSTER):
+    snapshots = []
+    for path in glob.glob(snapshot_path(cluster, '*')):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            logger.warning(f"无法读取快照清单: {path}")
+    return sorted(snapshots, key=lambda snapshot: snapshot['created'])
+
+def load_snapshot(cluster, snapshot_id):
+    if not SNAPSHOT_ID_RE.match(snapshot_id):
+        return None
+    try:
+        with open(snapshot_path(cluster, snapshot_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def snapshot_summary(snapshot):
+    return {key: value for key, value in snapshot.items() if key not in ('files', 'dirs')}
+
+def create_snapshot(cluster=DEFAULT_CLUSTER):
+    base = cluster_path(cluster)
+    previous = list_snapshots(cluster)
+    previous_files = previous[-1]['files'] if previous else {}
+    shards = [shard for shard in cluster_shards(cluster) if os.path.isdir(f"{shard['path']}/save")]
+    if not shards:
+        logger.error(f"集群{cluster}没有可备份的存档")
+        return None
+
+    started = time.monotonic()
+    files, dirs = {}, []
+    batch, queued = [], set()
+    totals = {'bytes': 0, 'reused_files': 0, 'new_chunks': 0, 'new_bytes': 0, 'stored_bytes': 0}
+    for shard in shards:
+        for root, dirnames, filenames in os.walk(f"{shard['path']}/save"):
+            dirs.append(os.path.relpath(root, base))
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                relative = os.path.relpath(path, base)
+                # 运行中的分片会轮换并删除旧的存档文件，遍历后消失的文件直接跳过
+                try:
+                    file_stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entry = {'size': file_stat.st_size, 'mtime_ns': file_stat.st_mtime_ns, 'mode': stat.S_IMODE(file_stat.st_mode)}
+                totals['bytes'] += file_stat.st_size
+                old = previous_files.get(relative)
+                if old and (old['size'], old['mtime_ns']) == (entry['size'], entry['mtime_ns']):
+                    entry['chunks'] = old['chunks']
+                    totals['reused_files'] += 1
+                    files[relative] = entry
+                    continue
+
+                entry['chunks'] = []
+                try:
+                    f = open(path, 'rb')
+                except FileNotFoundError:
+                    totals['bytes'] -= entry['size']
+                    continue
+                with f:
+                    for data in iter(lambda: f.read(BACKUP_CHUNK_SIZE), b''):
+                        digest = hashlib.sha256(data).hexdigest()
+                        entry['chunks'].append(digest)
+                        if digest in queued or os.path.exists(chunk_path(digest)):
+                            continue
+                        queued.add(digest)
+                        batch.append((digest, data))
+                        totals['new_chunks'] += 1
+                        totals['new_bytes'] += len(data)
+                        if len(batch) >= BACKUP_BATCH_CHUNKS:
+                            totals['stored_bytes'] += _store_chunks(batch)
+                            batch = []
+                files[relative] = entry
+    if batch:
+        totals['stored_bytes'] += _store_chunks(batch)
+
+    created = time.time()
+    snapshot = {
+        'id': f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(created))}-{uuid.uuid4().hex[:6]}",
+        'cluster': cluster,
+        'created': created,
+        'shards': [shard['shard'] for shard in shards],
+        'file_count': len(files),
+        **totals,
+        'seconds': round(time.monotonic() - started, 3),
+        'dirs': dirs,
+        'files': files
+    }
+    path = snapshot_path(cluster, snapshot['id'])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_file_atomic(path, json.dumps(snapshot))
+    logger.info(f"已创建{cluster}快照{snapshot['id']}: {len(files)}个文件，新增{totals['new_bytes']}字节，写入{totals['stored_bytes']}字节")
+    return snapshot
+
+def collect_chunk_garbage():
+    # 删除不再被任何快照引用的分块，返回删除的数量
+    referenced = set()
+    for path in glob.glob(snapshot_path('*', '*')):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            # 读不出的清单可能仍引用分块，宁可不回收
+            logger.warning(f"无法读取快照清单，跳过分块回收: {path}")
+            return 0
+        for entry in snapshot['files'].values():
+            referenced.update(entry['chunks'])
+    removed = 0
+    for path in glob.glob(f'{BACKUP_ROOT}/chunks/*/*'):
+        if os.path.basename(path) not in referenced:
+            os.remove(path)
+            removed += 1
+    return removed
+
+def prune_snapshots(cluster=DEFAULT_CLUSTER):
+    # 保留最近 BACKUP_KEEP_LAST 个快照，以及最近 BACKUP_KEEP_DAILY 天每天的最后一个快照
+    snapshots = list_snapshots(cluster)
+    keep = {snapshot['id'] for snapshot in snapshots[-BACKUP_KEEP_LAST:]} if BACKUP_KEEP_LAST else set()
+    daily = {}
+    for snapshot in snapshots:
+        daily[time.strftime('%Y-%m-%d', time.localtime(snapshot['created']))] = snapshot['id']
+    keep.update(snapshot_id for day, snapshot_id in sorted(daily.items())[-BACKUP_KEEP_DAILY:])
+    expired = [snapshot['id'] for snapshot in snapshots if snapshot['id'] not in keep]
+    for snapshot_id in expired:
+        os.remove(snapshot_path(cluster, snapshot_id))
+    if expired:
+        logger.info(f"已清理{cluster}的过期快照: {', '.join(expired)}，回收{collect_chunk_garbage()}个分块")
+    return expired
+
+def delete_snapshot(cluster, snapshot_id):
+    if load_snapshot(cluster, snapshot_id) is None:
         return False
-    
-    server_name = 'dst_server1' if shard == 'overworld' else 'dst_server2'
-    return output is not None and server_name in output
+    os.remove(snapshot_path(cluster, snapshot_id))
+    collect_chunk_garbage()
+    return True
+
+def restore_snapshot(cluster, snapshot_id):
+    # 先在 save.restore 中重建存档，完成后与原 save 目录交换，中途失败不会破坏现有存档
+    snapshot = load_snapshot(cluster, snapshot_id)
+    if snapshot is None:
+        logger.error(f"快照{cluster}/{snapshot_id}不存在")
+        return False
+    base = cluster_path(cluster)
+    restored = []
+    for shard in snapshot['shards']:
+        save_path = f'{base}/{shard}/save'
+        staging = f'{save_path}.restore'
+        shutil.rmtree(staging, ignore_errors=True)
+        prefix = f'{shard}/save'
+
+        def staged(relative):
+            return staging + relative[len(prefix):]
+
+        for relative in snapshot['dirs']:
+            if relative == prefix or relative.startswith(prefix + '/'):
+                os.makedirs(staged(relative), exist_ok=True)
+        for relative, entry in snapshot['files'].items():
+            if not relative.startswith(prefix + '/'):
+                continue
+            path = staged(relative)
+            with open(path, 'wb') as f:
+                for digest in entry['chunks']:
+                    with open(chunk_path(digest), 'rb') as chunk:
+                        f.write(zlib.decompress(chunk.read()))
+            os.chmod(path, entry['mode'])
+            os.utime(path, ns=(entry['mtime_ns'], entry['mtime_ns']))
+            restored.append(relative)
+
+        if os.path.exists(save_path):
+            shutil.rmtree(f'{save_path}.old', ignore_errors=True)
+            os.rename(save_path, f'{save_path}.old')
+        os.rename(staging, save_path)
+        shutil.rmtree(f'{save_path}.old', ignore_errors=True)
+    set_ownership([f'{base}/{relative}' for relative in snapshot['dirs'] + restored], 'dst')
+    logger.info(f"已从快照{snapshot_id}恢复{cluster}的{len(restored)}个文件")
+    return True
+
+def backup_steps(clusters):
+    def snapshot_step(cluster):
+        def step():
+            with _backup_store_lock:
+                if create_snapshot(cluster) is None:
+                    return False
+                prune_snapshots(cluster)
+            return True
+        return (f"备份{cluster}", step)
+    return [snapshot_step(cluster) for cluster in clusters]
+
+def restore_steps(cluster, snapshot_id):
+    # 恢复前停止运行中的分片，恢复后重新启动它们
+    running = []
+
+    def stop():
+        status = get_server_status(force=True)
+        running[:] = [shard for shard in cluster_shards(cluster) if status.get((shard['cluster'], shard['shard']))]
+        return all(result['stopped'] for result in stop_shards(running).values())
+
+    def restore():
+        with _backup_store_lock:
+            return restore_snapshot(cluster, snapshot_id)
+
+    def start():
+        if not running:
+            return True
+        return all(result['started'] for result in start_shards(running).values())
+
+    return [("停止分片", stop), ("恢复存档", restore), ("重新启动分片", start)]
+
+def _backup_loop():
+    while True:
+        time.sleep(BACKUP_INTERVAL)
+        job, created = submit_job('backup', backup_steps(list(get_clusters())), lock=BACKUP_ROOT)
+        if not created:
+            logger.warning(f"上一次备份任务{job['job_id']}尚未完成，跳过本次自动备份")
+
+def ensure_backup_scheduler_started():
+    if not BACKUP_INTERVAL:
+        return
+    with _backup_lock:
+        if _backup_state['thread'] is None:
+            thread = threading.Thread(target=_backup_loop, name='dst-backup', daemon=True)
+            _backup_state['thread'] = thread
+            thread.start()
+
+def read_log_from(path, offset, limit=LOG_CHUNK_LIMIT):
+    # 从字节偏移处读取完整的行，返回 (数据, 下一个偏移, 文件大小)
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if offset > size:
+            # 服务器重启后日志会被重写，从头开始读
+            offset = 0
+        if offset >= size:
+            return b'', offset, size
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = min(size, len(mm))
+            end = min(size, offset + limit)
+            cut = mm.rfind(b'\n', offset, end)
+            if cut != -1:
+                end = cut + 1
+            elif end == size:
+                # 最后一行还没写完，等下次再读
+                return b'', offset, size
+            return mm[offset:end], end, size
+
+def tail_log_lines(path, lines, limit=LOG_CHUNK_LIMIT):
+    # 从文件末尾向前查找换行符，只映射不读入整个文件
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return b'', 0, 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            size = min(size, len(mm))
+            end = mm.rfind(b'\n', 0, size) + 1 or size
+            start = end
+            floor = max(0, end - limit)
+            for _ in range(lines):
+                if start <= floor:
+                    break
+                cut = mm.rfind(b'\n', floor, start - 1)
+                start = cut + 1 if cut != -1 else floor
+            return mm[start:end], start, end
+
+def follow_log(path, offset):
+    # SSE：每个事件是一行日志，事件ID为该行之后的字节偏移；面板关闭时结束
+    idle = 0
+    while not _shutdown_event.is_set():
+        try:
+            data, offset, size = read_log_from(path, offset)
+        except OSError:
+            data = b''
+        if data:
+            idle = 0
+            for line in data.decode('utf-8', 'replace').splitlines():
+                yield f"data: {line}\n\n"
+            yield f"id: {offset}\nevent: offset\ndata: {offset}\n\n"
+            continue
+        idle += LOG_FOLLOW_INTERVAL
+        if idle >= LOG_FOLLOW_KEEPALIVE:
+            idle = 0
+            yield ": keepalive\n\n"
+        _shutdown_event.wait(LOG_FOLLOW_INTERVAL)
+
+_console_queues = {}
+_console_lock = threading.Lock()
+
+def _escape_screen_stuff(command):
+    # screen 的 stuff 会解释 \ 和 ^ 转义
+    return command.replace('\\', '\\\\').replace('^', '\\^')
+
+def inject_console_commands(shard, commands):
+    # 一次 screen -X stuff 注入多条命令，返回注入后新产生的日志行
+    position = log_position(shard)
+    payload = ''.join(_escape_screen_stuff(command) + '\r' for command in commands)
+    output, error = run_command(['screen', '-S', shard['screen'], '-p', '0', '-X', 'stuff', payload], user='dst')
+    if error:
+        logger.error(f"向{shard['cluster']}/{shard['shard']}发送控制台命令时出错: {error}")
+        return {'sent': False, 'commands': commands, 'error': error, 'output': []}
+
+    time.sleep(CONSOLE_OUTPUT_WAIT)
+    lines = []
+    while len(lines) < CONSOLE_OUTPUT_LINES:
+        data, position, rewritten = advance_log(shard, position)
+        if not data:
+            break
+        lines.extend(data.decode('utf-8', 'replace').splitlines())
+    return {'sent': True, 'commands': commands, 'error': None, 'output': lines[:CONSOLE_OUTPUT_LINES]}
+
+def send_console_commands(shard, commands):
+    # 同一分片的命令先排队；第一个到达的请求等待合并窗口后把队列中的命令按顺序一次性注入
+    # （控制台命令不是幂等的，重复的命令也要执行），同一批的请求共享结果。返回 None 表示队列已满
+    key = (shard['cluster'], shard['shard'])
+    done = threading.Event()
+    result = {}
+    with _console_lock:
+        queue = _console_queues.setdefault(key, {
+            'commands': [], 'waiters': [], 'flushing': False, 'last': 0.0, 'inject_lock': threading.Lock()
+        })
+        if len(queue['commands']) + len(commands) > CONSOLE_QUEUE_LIMIT:
+            return None
+        queue['commands'].extend(commands)
+        queue['waiters'].append((done, result))
+        leader = not queue['flushing']
+        queue['flushing'] = True
+
+    if leader:
+        with queue['inject_lock']:
+            time.sleep(max(CONSOLE_BATCH_WINDOW, queue['last'] + CONSOLE_MIN_INTERVAL - time.monotonic()))
+            with _console_lock:
+                batch = queue['commands']
+                waiters = queue['waiters']
+                queue['commands'], queue['waiters'] = [], []
+                queue['flushing'] = False
+                queue['last'] = time.monotonic()
+            outcome = inject_console_commands(shard, batch)
+        for waiter_done, waiter_result in waiters:
+            waiter_result.update(outcome)
+            waiter_done.set()
+
+    done.wait()
+    return result
+
+TELEMETRY_PATTERNS = [
+    ('join', re.compile(r'\[Join Announcement\] (?P<player>.+)$')),
+    ('leave', re.compile(r'\[Leave Announcement\] (?P<player>.+)$')),
+    ('chat', re.compile(r'\[(?:Say|Whisper)\] \((?P<userid>[^)]*)\) (?P<player>[^:]+): (?P<message>.*)$')),
+    ('day', re.compile(r'\b[Dd]ay (?P<day>\d+)\b')),
+    ('error', re.compile(r'LUA ERROR|\[error\]|\bError\b.*'))
+]
+LOG_UPTIME_RE = re.compile(r'^\[(\d+:\d+:\d+)\]:\s*')
+
+_telemetry_lock = threading.Condition()
+_telemetry_events = deque(maxlen=TELEMETRY_EVENT_LIMIT)
+_telemetry_state = {'next_id': 1, 'positions': {}, 'players': {}, 'days': {}, 'thread': None}
+
+def parse_log_line(line):
+    # 返回 (事件类型, 字段)；不关心的行返回 None
+    match = LOG_UPTIME_RE.match(line)
+    uptime = match.group(1) if match else None
+    text = line[match.end():] if match else line
+    for kind, pattern in TELEMETRY_PATTERNS:
+        found = pattern.search(text)
+        if found:
+            fields = {key: value.strip() for key, value in found.groupdict().items() if value is not None}
+            if kind == 'day':
+                fields['day'] = int(fields['day'])
+            elif kind == 'error':
+                fields['message'] = text.strip()
+            fields['uptime'] = uptime
+            return kind, fields
+    return None
+
+def _add_event(key, kind, fields):
+    # 调用方需持有 _telemetry_lock
+    event = {'id': _telemetry_state['next_id'], 'time': time.time(), 'cluster': key[0], 'shard': key[1],
+             'type': kind, **fields}
+    _telemetry_state['next_id'] += 1
+    _telemetry_events.append(event)
+    return event
+
+def ingest_log_lines(key, lines, rewritten=False):
+    with _telemetry_lock:
+        players = _telemetry_state['players'].setdefault(key, {})
+        if rewritten:
+            # 日志被重写说明分片重启了，之前的在线玩家都已离开
+            players.clear()
+            _telemetry_state['days'].pop(key, None)
+            _add_event(key, 'restart', {})
+        added = 0
+        for line in lines:
+            parsed = parse_log_line(line)
+            if parsed is None:
+                continue
+            kind, fields = parsed
+            if kind == 'join':
+                players[fields['player']] = time.time()
+            elif kind == 'leave':
+                players.pop(fields['player'], None)
+            elif kind == 'day':
+                if _telemetry_state['days'].get(key) == fields['day']:
+                    continue
+                _telemetry_state['days'][key] = fields['day']
+            _add_event(key, kind, fields)
+            added += 1
+        if added or rewritten:
+            _telemetry_lock.notify_all()
+
+def poll_telemetry():
+    for shard in cluster_shards():
+        key = (shard['cluster'], shard['shard'])
+        # 第一次读取时从头解析当前日志，以得到当前在线的玩家
+        position = _telemetry_state['positions'].get(key)
+        rewritten = False
+        while True:
+            data, position, was_rewritten = advance_log(shard, position)
+            rewritten = rewritten or was_rewritten
+            if not data:
+                break
+            ingest_log_lines(key, data.decode('utf-8', 'replace').splitlines(), rewritten)
+            rewritten = False
+        _telemetry_state['positions'][key] = position
+        if rewritten:
+            ingest_log_lines(key, [], True)
+
+def _telemetry_loop():
+    while True:
+        try:
+            poll_telemetry()
+        except Exception as e:
+            logger.exception(f"解析服务器日志时出错: {str(e)}")
+        time.sleep(TELEMETRY_INTERVAL)
+
+def ensure_telemetry_started():
+    with _telemetry_lock:
+        if _telemetry_state['thread'] is None:
+            thread = threading.Thread(target=_telemetry_loop, name='dst-telemetry', daemon=True)
+            _telemetry_state['thread'] = thread
+            thread.start()
+
+def online_players(cluster=None):
+    # 日志只在下次启动时才会被重写，已停止分片上残留的玩家不算在线
+    status = get_server_status()
+    with _telemetry_lock:
+        return [
+            {'name': name, 'cluster': key[0], 'shard': key[1], 'since': since}
+            for key, players in _telemetry_state['players'].items() if cluster in (None, key[0]) and status.get(key)
+            for name, since in players.items()
+        ]
+
+def events_since(since=0, limit=None, kinds=None, cluster=None):
+    with _telemetry_lock:
+        events = [event for event in _telemetry_events
+                  if event['id'] > since and (not kinds or event['type'] in kinds)
+                  and cluster in (None, event['cluster'])]
+    return events[-limit:] if limit else events
+
+def stream_events(since):
+    # SSE：事件ID就是事件序号，断线重连时浏览器会带上 Last-Event-ID；面板关闭时结束
+    while not _shutdown_event.is_set():
+        with _telemetry_lock:
+            if _telemetry_state['next_id'] - 1 <= since:
+                _telemetry_lock.wait(TELEMETRY_STREAM_KEEPALIVE)
+        if _shutdown_event.is_set():
+            return
+        events = events_since(since)
+        if not events:
+            yield ": keepalive\n\n"
+            continue
+        for event in events:
+            since = event['id']
+            yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+# 日志搜索：倒排索引 词 -> [(文件编号 << 32) | 行号]。每个文件记录已索引到的偏移、
+# 每行的起始偏移和运行时间，刷新时只读取新增的字节；文件被重写或删除后标记为失效，
+# 失效的行超过有效行时整体重建
+_log_index_lock = threading.Lock()
+_log_index = {'files': [], 'paths': {}, 'postings': {}, 'live_lines': 0, 'dead_lines': 0}
+
+def shard_log_files(shard_info):
+    rotated = sorted(glob.glob(f"{shard_info['path']}/backup/server_log/*.txt"))
+    return rotated + [shard_log_path(shard_info)]
+
+def _uptime_seconds(uptime):
+    hours, minutes, seconds = uptime.split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+def _index_line(record, line, position):
+    text = line.decode('utf-8', 'replace')
+    match = LOG_UPTIME_RE.match(text)
+    if match:
+        record['last_uptime'] = _uptime_seconds(match.group(1))
+        text = text[match.end():]
+    posting = (record['id'] << 32) | len(record['offsets'])
+    record['offsets'].append(position)
+    record['uptimes'].append(record['last_uptime'])
+    postings = _log_index['postings']
+    for token in set(LOG_TOKEN_RE.findall(text.lower())):
+        postings.setdefault(token, array('Q')).append(posting)
+
+def _index_file_tail(record):
+    # 只索引完整的行，最后不完整的一行留到下次刷新
+    position = record['size']
+    lines_before = len(record['offsets'])
+    with open(record['path'], 'rb') as f:
+        f.seek(position)
+        buffer = b''
+        for block in iter(lambda: f.read(LOG_INDEX_CHUNK), b''):
+            buffer += block
+            lines = buffer.split(b'\n')
+            buffer = lines.pop()
+            for line in lines:
+                _index_line(record, line, position)
+                position += len(line) + 1
+    record['size'] = position
+    _log_index['live_lines'] += len(record['offsets']) - lines_before
+
+def _retire_log_file(record):
+    record['dead'] = True
+    del _log_index['paths'][record['path']]
+    _log_index['live_lines'] -= len(record['offsets'])
+    _log_index['dead_lines'] += len(record['offsets'])
+
+def refresh_log_index(shards):
+    # 调用方需持有 _log_index_lock
+    if _log_index['dead_lines'] > _log_index['live_lines']:
+        _log_index.update({'files': [], 'paths': {}, 'postings': {}, 'live_lines': 0, 'dead_lines': 0})
+
+    for shard in shards:
+        key = (shard['cluster'], shard['shard'])
+        seen = set()
+        for path in shard_log_files(shard):
+            try:
+                file_stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            seen.add(path)
+            record = _log_index['paths'].get(path)
+            if record and (record['inode'] != file_stat.st_ino or file_stat.st_size < record['size']):
+                _retire_log_file(record)
+                record = None
+            if record is None:
+                record = {'id': len(_log_index['files']), 'path': path, 'key': key, 'inode': file_stat.st_ino,
+                          'size': 0, 'offsets': array('Q'), 'uptimes': array('l'), 'last_uptime': 0, 'dead': False}
+                _log_index['files'].append(record)
+                _log_index['paths'][path] = record
+            record['mtime'] = file_stat.st_mtime
+            if file_stat.st_size > record['size']:
+                _index_file_tail(record)
+        for record in [record for record in _log_index['paths'].values() if record['key'] == key and record['path'] not in seen]:
+            _retire_log_file(record)
+
+def _line_time(record, line):
+    # 日志只有运行时间，用文件最后修改时间减去最后的运行时间估算分片启动时间
+    return record['mtime'] - record['last_uptime'] + record['uptimes'][line]
+
+def search_logs(query, shards, start=None, end=None, offset=0, limit=LOG_SEARCH_PAGE_SIZE):
+    # 所有词都出现的行，按时间从新到旧排序，返回 (总数, 当前页结果)
+    tokens = set(LOG_TOKEN_RE.findall(query.lower()))
+    if not tokens:
+        return 0, []
+    keys = {(shard['cluster'], shard['shard']) for shard in shards}
+    with _log_index_lock:
+        refresh_log_index(shards)
+        lists = [_log_index['postings'].get(token) for token in tokens]
+        if not all(lists):
+            return 0, []
+        lists.sort(key=len)
+        matches = set(lists[0])
+        for postings in lists[1:]:
+            matches.intersection_update(postings)
+
+        hits = []
+        for posting in matches:
+            record = _log_index['files'][posting >> 32]
+            if record['dead'] or record['key'] not in keys:
+                continue
+            line = posting & 0xFFFFFFFF
+            line_time = _line_time(record, line)
+            if (start is not None and line_time < start) or (end is not None and line_time > end):
+                continue
+            hits.append((line_time, record['id'], line))
+        hits.sort(reverse=True)
+        page = [(line_time, _log_index['files'][file_id], line) for line_time, file_id, line in hits[offset:offset + limit]]
+        page = [(line_time, record, line, record['offsets'][line], record['uptimes'][line]) for line_time, record, line in page]
+
+    results = []
+    handles = {}
+    try:
+        for line_time, record, line, position, uptime in page:
+            if record['path'] not in handles:
+                handles[record['path']] = open(record['path'], 'rb')
+            handle = handles[record['path']]
+            handle.seek(position)
+            results.append({
+                "cluster": record['key'][0],
+                "shard": record['key'][1],
+                "file": os.path.basename(record['path']),
+                "line": line + 1,
+                "offset": position,
+                "time": round(line_time, 3),
+                "uptime": uptime,
+                "text": handle.readline().decode('utf-8', 'replace').rstrip('\r\n')
+            })
+    finally:
+        for handle in handles.values():
+            handle.close()
+    return len(hits), results
+
+def log_index_stats():
+    with _log_index_lock:
+        return {
+            "files": len(_log_index['paths']),
+            "lines": _log_index['live_lines'],
+            "tokens": len(_log_index['postings'])
+        }
+
+# 资源监控：按分片保存 /proc 采样的环形缓冲区
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+_resource_lock = threading.Lock()
+_resource_history = {}
+_resource_state = {'last': {}, 'streaks': {}, 'restarted': {}, 'thread': None}
+
+def read_process_sample(pid):
+    with open(f'/proc/{pid}/stat', 'r') as f:
+        data = f.read()
+    # 进程名可能包含空格和括号，从最后一个 ')' 之后开始按字段拆分（第 3 个字段起）
+    fields = data[data.rindex(')') + 2:].split()
+    with open(f'/proc/{pid}/statm', 'r') as f:
+        rss_pages = int(f.read().split()[1])
+    try:
+        fds = len(os.listdir(f'/proc/{pid}/fd'))
+    except PermissionError:
+        fds = None
+    return {
+        'cpu_ticks': int(fields[11]) + int(fields[12]),
+        'threads': int(fields[17]),
+        'start_ticks': int(fields[19]),
+        'rss': rss_pages * PAGE_SIZE,
+        'fds': fds
+    }
+
+def _resource_alert(key, metric, value, threshold):
+    logger.warning(f"{key[0]}/{key[1]}的{metric}连续{RESOURCE_ALERT_SAMPLES}次超过阈值: {value} >= {threshold}")
+    with _telemetry_lock:
+        _add_event(key, 'alert', {'metric': metric, 'value': value, 'threshold': threshold})
+        _telemetry_lock.notify_all()
+    if metric == 'rss' and RESOURCE_AUTO_RESTART:
+        restart_shard_for_resources(key)
+
+def restart_shard_for_resources(key):
+    shard = get_shard(*key)
+    if shard is None:
+        return None
+    with _resource_lock:
+        last = _resource_state['restarted'].get(key)
+        if last is not None and time.monotonic() - last < RESOURCE_RESTART_COOLDOWN:
+            logger.warning(f"{key[0]}/{key[1]}在冷却时间内已自动重启过，跳过")
+            return None
+        _resource_state['restarted'][key] = time.monotonic()
+    steps = [
+        ("停止分片", lambda: all(result['stopped'] for result in stop_shards([shard]).values())),
+        ("启动分片", lambda: all(result['started'] for result in start_shards([shard]).values()))
+    ]
+    job, created = submit_job('restart', steps, lock=SERVER_PATH)
+    if created:
+        logger.info(f"已提交{key[0]}/{key[1]}的自动重启任务{job['job_id']}")
+    return job
+
+def _check_resource_alerts(key, point):
+    # 同一次连续超限只告警一次
+    limits = (('rss', point['rss'], RESOURCE_ALERT_RSS), ('cpu', point['cpu'], RESOURCE_ALERT_CPU))
+    alerts = []
+    with _resource_lock:
+        streaks = _resource_state['streaks'].setdefault(key, {})
+        for metric, value, threshold in limits:
+            if value is not None and value >= threshold:
+                streaks[metric] = streaks.get(metric, 0) + 1
+                if streaks[metric] == RESOURCE_ALERT_SAMPLES:
+                    alerts.append((metric, value, threshold))
+            else:
+                streaks[metric] = 0
+    for alert in alerts:
+        _resource_alert(key, *alert)
+
+def poll_resources():
+    processes = scan_shard_processes() or {}
+    for key, pid in processes.items():
+        try:
+            sample = read_process_sample(pid)
+        except (OSError, ValueError, IndexError):
+            continue
+        now = time.monotonic()
+        with _resource_lock:
+            last = _resource_state['last'].get(key)
+            _resource_state['last'][key] = {'pid': pid, 'time': now, **sample}
+            cpu = None
+            # 分片重启后 pid 或启动时间会变化，需要重新建立 CPU 基准
+            if last and (last['pid'], last['start_ticks']) == (pid, sample['start_ticks']) and now > last['time']:
+                cpu = round((sample['cpu_ticks'] - last['cpu_ticks']) / CLOCK_TICKS / (now - last['time']) * 100, 1)
+            point = {'time': round(time.time(), 3), 'pid': pid, 'cpu': cpu, 'rss': sample['rss'],
+                     'threads': sample['threads'], 'fds': sample['fds']}
+            _resource_history.setdefault(key, deque(maxlen=RESOURCE_HISTORY)).append(point)
+        _check_resource_alerts(key, point)
+
+def _resource_loop():
+    while True:
+        try:
+            poll_resources()
+        except Exception as e:
+            logger.exception(f"采样分片资源时出错: {str(e)}")
+        time.sleep(RESOURCE_INTERVAL)
+
+def ensure_resource_monitor_started():
+    with _resource_lock:
+        if _resource_state['thread'] is None:
+            thread = threading.Thread(target=_resource_loop, name='dst-resources', daemon=True)
+            _resource_state['thread'] = thread
+            thread.start()
+
+def downsample_resources(points, buckets):
+    # 每个桶取 CPU 平均值，内存、线程数和文件描述符取最大值，保留峰值
+    if buckets <= 0 or len(points) <= buckets:
+        return points
+    size = len(points) / buckets
+    result = []
+    for index in range(buckets):
+        group = points[int(index * size):int((index + 1) * size)]
+        cpus = [point['cpu'] for point in group if point['cpu'] is not None]
+        fds = [point['fds'] for point in group if point['fds'] is not None]
+        result.append({
+            'time': group[-1]['time'],
+            'pid': group[-1]['pid'],
+            'cpu': round(sum(cpus) / len(cpus), 1) if cpus else None,
+            'rss': max(point['rss'] for point in group),
+            'threads': max(point['threads'] for point in group),
+            'fds': max(fds) if fds else None
+        })
+    return result
+
+def resource_history(key, since=None):
+    with _resource_lock:
+        points = list(_resource_history.get(key, ()))
+    if since is not None:
+        points = [point for point in points if point['time'] > since]
+    return points
+
+# 历史记录：samples 表按 (级别, 集群, 分片, 时间) 存储，级别为汇总的时间粒度（秒），0 为原始样本。
+# running 为运行时间占比，starts 为期间启动次数，players 为平均在线人数
+_history_lock = threading.Lock()
+_history_state = {'db': None, 'thread': None, 'previous': {}}
+
+def history_db():
+    # 调用方需持有 _history_lock
+    if _history_state['db'] is None:
+        db = sqlite3.connect(HISTORY_PATH, check_same_thread=False)
+        db.execute("""CREATE TABLE IF NOT EXISTS samples (
+            level INTEGER, cluster TEXT, shard TEXT, time INTEGER,
+            running REAL, starts INTEGER, players REAL, players_max INTEGER, cpu REAL, rss INTEGER,
+            PRIMARY KEY (level, cluster, shard, time)) WITHOUT ROWID""")
+        _history_state['db'] = db
+    return _history_state['db']
+
+def _rollup_history(db, now):
+    # 重新汇总当前和上一个时间桶，已完成的桶不会再变化，未完成的桶随新样本更新
+    for (source, _), (level, _) in zip(HISTORY_LEVELS, HISTORY_LEVELS[1:]):
+        since = (now // level - 1) * level
+        db.execute("""INSERT OR REPLACE INTO samples
+            SELECT ?, cluster, shard, time / ? * ?, avg(running), sum(starts), avg(players), max(players_max), avg(cpu), max(rss)
+            FROM samples WHERE level = ? AND time >= ? GROUP BY cluster, shard, time / ?""",
+            (level, level, level, source, since, level))
+    for level, retention in HISTORY_LEVELS:
+        db.execute("DELETE FROM samples WHERE level = ? AND time < ?", (level, now - retention))
+
+def record_history():
+    now = int(time.time())
+    status = get_server_status(force=True)
+    with _telemetry_lock:
+        players = {key: len(names) for key, names in _telemetry_state['players'].items()}
+    rows = []
+    for key, running in status.items():
+        resources = resource_history(key, since=now - 2 * RESOURCE_INTERVAL)
+        latest = resources[-1] if resources and running else {}
+        started = running and not _history_state['previous'].get(key, running)
+        _history_state['previous'][key] = running
+        count = players.get(key, 0) if running else 0
+        rows.append((0, key[0], key[1], now, float(running), int(started), count, count, latest.get('cpu'), latest.get('rss')))
+    with _history_lock:
+        db = history_db()
+        with db:
+            db.executemany("INSERT OR REPLACE INTO samples VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            _rollup_history(db, now)
+
+def _history_loop():
+    while True:
+        try:
+            record_history()
+        except Exception as e:
+            logger.exception(f"记录历史数据时出错: {str(e)}")
+        time.sleep(HISTORY_INTERVAL)
+
+def ensure_history_started():
+    # 在线人数来自日志遥测，CPU 和内存来自资源监控
+    ensure_telemetry_started()
+    ensure_resource_monitor_started()
+    with _history_lock:
+        if _history_state['thread'] is None:
+            thread = threading.Thread(target=_history_loop, name='dst-history', daemon=True)
+            _history_state['thread'] = thread
+            thread.start()
+
+def parse_history_range(value):
+    # 支持 90、30m、24h、7d 等写法，返回秒数
+    units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+    if value and value[-1] in units:
+        # inf 之类的非有限数按格式错误处理
+        try:
+            return int(float(value[:-1]) * units[value[-1]])
+        except OverflowError:
+            raise ValueError(f"无效的时间范围: {value}")
+    return int(value)
+
+def query_history(key, seconds):
+    # 选择能覆盖整个范围的最细粒度，点数过多时在 SQL 中再按时间桶合并
+    now = int(time.time())
+    level = next((level for level, retention in HISTORY_LEVELS if retention >= seconds), HISTORY_LEVELS[-1][0])
+    bucket = max(level, 1, -(-seconds // HISTORY_MAX_POINTS))
+    with _history_lock:
+        rows = history_db().execute("""SELECT time / ? * ?, avg(running), sum(starts), avg(players), max(players_max), avg(cpu), max(rss)
+            FROM samples WHERE level = ? AND cluster = ? AND shard = ? AND time >= ?
+            GROUP BY time / ? ORDER BY time""",
+            (bucket, bucket, level, key[0], key[1], now - seconds, bucket)).fetchall()
+    points = [
+        {'time': row[0], 'running': round(row[1], 3), 'starts': row[2], 'players': round(row[3], 2),
+         'players_max': row[4], 'cpu': round(row[5], 1) if row[5] is not None else None, 'rss': row[6]}
+        for row in rows
+    ]
+    return level, bucket, points
+
+# 多主机控制：代理登记表
+_agents_lock = threading.Lock()
+_agents = {'data': None}
+_agent_executor = ThreadPoolExecutor(max_workers=AGENT_WORKERS, thread_name_prefix='dst-agent')
+
+def load_agents():
+    with _agents_lock:
+        if _agents['data'] is None:
+            try:
+                with open(AGENTS_PATH, 'r', encoding='utf-8') as f:
+                    _agents['data'] = json.load(f)
+            except (OSError, ValueError):
+                _agents['data'] = {}
+        return dict(_agents['data'])
+
+def save_agents(agents):
+    write_file_atomic(AGENTS_PATH, json.dumps(agents, ensure_ascii=False, indent=2))
+    os.chmod(AGENTS_PATH, 0o600)
+    with _agents_lock:
+        _agents['data'] = dict(agents)
+
+def agent_request(agent, method, path, body=None, timeout=AGENT_TIMEOUT):
+    # 返回 (状态码, 响应数据)；网络错误时抛出异常
+    url = agent['url'].rstrip('/')
+    headers = {'X-API-Key': agent['api_key'], 'Accept': 'application/json'}
+    payload = None
+    if body is not None:
+        payload = json.dumps(body).encode('utf-8')
+        headers['Content-Type'] = 'application/json'
+    parts = urlsplit(url)
+    connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+    connection = connection_class(parts.hostname, parts.port, timeout=timeout)
+    try:
+        connection.request(method, parts.path + path, body=payload, headers=headers)
+        response = connection.getresponse()
+        data = response.read()
+    finally:
+        connection.close()
+    try:
+        return response.status, json.loads(data) if data else None
+    except ValueError:
+        return response.status, data.decode('utf-8', 'replace')
+
+def fan_out_agents(method, path, body=None, names=None, timeout=AGENT_TIMEOUT):
+    # 并行请求各代理，超过 timeout 的主机记为超时，不影响其他主机的结果
+    agents = load_agents()
+    if names:
+        agents = {name: agent for name, agent in agents.items() if name in names}
+    started = time.monotonic()
+
+    def call(name, agent):
+        try:
+            status, data = agent_request(agent, method, path, body, timeout)
+        except Exception as e:
+            return None, str(e) or type(e).__name__, round(time.monotonic() - started, 3)
+        return status, data, round(time.monotonic() - started, 3)
+
+    futures = {name: _agent_executor.submit(call, name, agent) for name, agent in agents.items()}
+    wait_futures(futures.values(), timeout=timeout)
+    results = {}
+    for name, future in futures.items():
+        if not future.done():
+            future.cancel()
+            results[name] = {'ok': False, 'status': None, 'error': f"超过{timeout:g}秒未响应", 'seconds': timeout}
+            continue
+        status, data, seconds = future.result()
+        if status is None:
+            results[name] = {'ok': False, 'status': None, 'error': data, 'seconds': seconds}
+            continue
+        results[name] = {'ok': 200 <= status < 300, 'status': status, 'data': data, 'seconds': seconds}
+    return results
+
+@app.route('/agents', methods=['GET', 'POST', 'OPTIONS'])
+@require_api_key
+def agents():
+    if request.method == 'GET':
+        return jsonify({"agents": {name: {"url": agent['url']} for name, agent in load_agents().items()}}), 200
+    body = request.get_json(silent=True) or {}
+    name, url, api_key = body.get('name'), body.get('url'), body.get('api_key')
+    if not name or not api_key or not url or urlsplit(url).scheme not in ('http', 'https') or not urlsplit(url).hostname:
+        return jsonify({"状态": "错误", "消息": "需要 name、api_key 和 http(s) 地址 url"}), 400
+    registered = load_agents()
+    registered[name] = {'url': url, 'api_key': api_key}
+    save_agents(registered)
+    return jsonify({"状态": "成功", "消息": f"已登记主机{name}"}), 200
+
+@app.route('/agents/<name>', methods=['DELETE', 'OPTIONS'])
+@require_api_key
+def remove_agent(name):
+    registered = load_agents()
+    if registered.pop(name, None) is None:
+        return jsonify({"状态": "错误", "消息": f"主机{name}未登记"}), 404
+    save_agents(registered)
+    return jsonify({"状态": "成功", "消息": f"已移除主机{name}"}), 200
+
+@app.route('/fleet/<path:path>', methods=['GET', 'POST', 'PATCH', 'DELETE', 'OPTIONS'])
+@require_api_key
+def fleet(path):
+    # 把请求原样转发给所有代理（或 ?hosts= 指定的主机），例如 /fleet/status、/fleet/start_all、/fleet/config
+    args = request.args.to_dict()
+    names = set(args.pop('hosts').split(',')) if args.get('hosts') else None
+    try:
+        default_timeout = AGENT_TIMEOUT if request.method == 'GET' else AGENT_ACTION_TIMEOUT
+        timeout = float(args.pop('host_timeout', default_timeout))
+    except ValueError:
+        return jsonify({"状态": "错误", "消息": "host_timeout 必须是数字"}), 400
+    target = f"/{path}" + (f"?{urlencode(args)}" if args else '')
+    body = request.get_json(silent=True) if request.method in ('POST', 'PATCH') else None
+
+    results = fan_out_agents(request.method, target, body, names, timeout)
+    failed = sorted(name for name, result in results.items() if not result['ok'])
+    summary = {"hosts": results, "ok": len(results) - len(failed), "failed": failed}
+    if not results:
+        return jsonify({"状态": "错误", "消息": "没有登记的主机", **summary}), 404
+    if not failed:
+        return jsonify(summary), 200
+    # 部分主机失败时返回 207，全部失败返回 502
+    return jsonify(summary), 207 if len(failed) < len(results) else 502
 
 @app.route('/install', methods=['POST', 'OPTIONS'])
 @require_api_key
 def install():
-    steps = [
-        ("安装依赖项", install_dependencies),
-        ("设置DST用户", setup_user),
-        ("安装SteamCMD", install_steamcmd),
-        ("安装DST服务器", install_dst_server),
-        ## ("配置服务器", configure_server),
-        ("设置Shell脚本", setup_shell_scripts)
-    ]
-    
-    for step_name, step_function in steps:
-        logger.info(f"开始{step_name}...")
-        if not step_function():
-            return jsonify({"状态": "错误", "消息": f"{step_name}失败"}), 500
-        logger.info(f"{step_name}完成")
-    
-    return jsonify({"状态": "成功", "消息": "服务器安装成功"}), 200
+    return job_response('install', INSTALL_STEPS, "服务器安装任务已提交")
+
+@app.route('/jobs/<job_id>', methods=['GET', 'OPTIONS'])
+@require_api_key
+def job_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({"状态": "错误", "消息": "任务不存在"}), 404
+    return jsonify(job), 200
 
 
-@app.route('/mods', methods=['GET', 'POST', 'OPTIONS'])
+@app.route('/metrics', methods=['GET', 'OPTIONS'])
 @require_api_key
-def manage_mods():
+def metrics():
+    with _jobs_lock:
+        in_flight = {}
+        for job in _jobs.values():
+            if job['finished'] is None:
+                in_flight[job['kind']] = in_flight.get(job['kind'], 0) + 1
+    gauges = [('dst_jobs_in_flight', (('kind', kind),), count) for kind, count in in_flight.items()]
+    if not gauges:
+        gauges.append(('dst_jobs_in_flight', (), 0))
+    return Response(render_metrics(gauges), mimetype='text/plain; version=0.0.4')
+
+def cluster_not_found(cluster):
+    return jsonify({"状态": "错误", "消息": f"集群{cluster}不存在"}), 404
+
+def stop_options_arg():
+    # ?mode=hard 直接结束 screen 会话；默认先存档再关闭，?timeout= 指定等待秒数
+    graceful = request.args.get('mode', 'graceful') != 'hard'
+    try:
+        timeout = max(0.0, float(request.args.get('timeout', SHUTDOWN_TIMEOUT)))
+    except ValueError:
+        timeout = SHUTDOWN_TIMEOUT
+    return graceful, timeout
+
+def stop_results_response(results):
+    shards = {shard: result for (cluster, shard), result in results.items()}
+    if all(result['stopped'] for result in results.values()):
+        return jsonify({"状态": "成功", "消息": "所有分片停止成功", "分片": shards}), 200
+    return jsonify({"状态": "错误", "消息": "部分分片停止失败", "分片": shards}), 500
+
+def ready_timeout_arg():
+    # 默认等待分片就绪；?wait=0 时启动后立即返回
+    if request.args.get('wait', '1') in ('0', 'false'):
+        return None
+    try:
+        return max(0.0, float(request.args.get('timeout', READY_TIMEOUT)))
+    except ValueError:
+        return READY_TIMEOUT
+
+def start_results_response(results, ready_timeout):
+    shards = {shard: result for (cluster, shard), result in results.items()}
+    if not all(result['started'] for result in results.values()):
+        return jsonify({"状态": "错误", "消息": "部分分片启动失败", "分片": shards}), 500
+    if ready_timeout and not all(result['ready'] for result in results.values()):
+        return jsonify({"状态": "错误", "消息": f"部分分片未在{ready_timeout:g}秒内就绪", "分片": shards}), 504
+    return jsonify({"状态": "成功", "消息": "所有分片启动成功", "分片": shards}), 200
+
+@app.route('/clusters', methods=['GET', 'OPTIONS'])
+@require_api_key
+def list_clusters():
+    clusters = get_clusters(force=request.args.get('refresh') is not None)
+    shard_status = get_server_status()
+    result = []
+    for cluster in clusters.values():
+        result.append({
+            "name": cluster['name'],
+            "shards": [
+                {
+                    "shard": shard['shard'],
+                    "name": shard['name'],
+                    "is_master": shard['is_master'],
+                    "server_port": shard['server_port'],
+                    "screen": shard['screen'],
+                    "running": shard_status.get((cluster['name'], shard['shard']), False)
+                }
+                for shard in cluster['shards'].values()
+            ]
+        })
+    return jsonify({"clusters": result}), 200
+
+@app.route('/clusters/<cluster>/status', methods=['GET', 'OPTIONS'])
+@require_api_key
+def cluster_status(cluster):
+    if get_cluster(cluster) is None:
+        return cluster_not_found(cluster)
+    return jsonify(shard_status_labels(cluster)), 200
+
+@app.route('/start_all', methods=['POST', 'OPTIONS'])
+@app.route('/clusters/<cluster>/start', methods=['POST', 'OPTIONS'])
+@require_api_key
+def start_cluster(cluster=DEFAULT_CLUSTER):
+    if get_cluster(cluster) is None:
+        return cluster_not_found(cluster)
+    ready_timeout = ready_timeout_arg()
+    return start_results_response(start_all_server(cluster, ready_timeout), ready_timeout)
+
+@app.route('/stop_all', methods=['POST', 'OPTIONS'])
+@app.route('/clusters/<cluster>/stop', methods=['POST', 'OPTIONS'])
+@require_api_key
+def stop_cluster(cluster=DEFAULT_CLUSTER):
+    if get_cluster(cluster) is None:
+        return cluster_not_found(cluster)
+    return stop_results_response(stop_all_server(cluster, *stop_options_arg()))
+
+@app.route('/mods', methods=['GET', 'POST', 'PATCH', 'OPTIONS'])
+@app.route('/clusters/<cluster>/mods', methods=['GET', 'POST', 'PATCH', 'OPTIONS'])
+@require_api_key
+def manage_mods(cluster=DEFAULT_CLUSTER):
+    if get_cluster(cluster) is None:
+        return cluster_not_found(cluster)
     if request.method == 'GET':
-        mods = read_modoverrides()
-        return jsonify({"mods": mods}), 200
+        try:
+            mods, version = read_modoverrides_versioned(cluster)
+        except ValueError as e:
+            return jsonify({"状态": "错误", "消息": f"解析modoverrides.lua时出错: {str(e)}"}), 500
+        return jsonify({"mods": mods, "version": version}), 200
     
     elif request.method == 'POST':
         new_mods = request.json.get('mods', {})
-        write_modoverrides(new_mods)
-        return jsonify({"状态": "成功", "消息": "MOD配置已更新"}), 200
+        with _modoverrides_write_lock:
+            version = write_modoverrides(new_mods, cluster)
+        return jsonify({"状态": "成功", "消息": "MOD配置已更新", "version": version}), 200
+
+    # PATCH：{"version": 读取时的版本号, "patch": {...}}，按 JSON Merge Patch 合并，null 表示删除
+    body = request.get_json(silent=True) or {}
+    patch = body.get('patch')
+    if not isinstance(patch, dict):
+        return jsonify({"状态": "错误", "消息": "patch 必须是对象"}), 400
+    expected_version = body.get('version', request.headers.get('If-Match', '').strip('"') or None)
+    try:
+        expected_version = int(expected_version) if expected_version is not None else None
+        mods, version, conflict = patch_modoverrides(patch, cluster, expected_version)
+    except (ValueError, TypeError) as e:
+        return jsonify({"状态": "错误", "消息": f"无法应用修改: {str(e)}"}), 400
+    if conflict:
+        return jsonify({"状态": "错误", "消息": "MOD配置已被修改，请刷新后重试", "mods": mods, "version": version}), 409
+    return jsonify({"状态": "成功", "消息": "MOD配置已更新", "mods": mods, "version": version}), 200
+
+@app.route('/mods/sync', methods=['GET', 'POST', 'OPTIONS'])
+@require_api_key
+def sync_mods():
+    if request.method == 'GET':
+        return jsonify(load_mod_manifest()), 200
+    # 强制检查所有MOD的更新，下载可能较慢，放到后台任务中执行
+    steps = [("同步MOD", lambda: update_mod_configuration(force=True))]
+    return job_response('mod_sync', steps, "MOD同步任务已提交")
     
 
 @app.route('/start/<shard>', methods=['POST', 'OPTIONS'])
+@app.route('/clusters/<cluster>/start/<shard>', methods=['POST', 'OPTIONS'])
 @require_api_key
-def start(shard):
-    if shard not in ['overworld', 'caves']:
+def start(shard, cluster=DEFAULT_CLUSTER):
+    shard_info = get_shard(cluster, shard)
+    if shard_info is None:
         return jsonify({"状态": "错误", "消息": "指定的分片无效"}), 400
-    if start_server(shard):
-        return jsonify({"状态": "成功", "消息": f"{shard}服务器启动成功"}), 200
-    else:
-        return jsonify({"状态": "错误", "消息": f"启动{shard}服务器失败"}), 500
+    ready_timeout = ready_timeout_arg()
+    result = start_shards([shard_info], ready_timeout)[(cluster, shard_info['shard'])]
+    if not result['started']:
+        return jsonify({"状态": "错误", "消息": f"启动{shard}服务器失败", **result}), 500
+    if ready_timeout and not result['ready']:
+        return jsonify({"状态": "错误", "消息": f"{shard}服务器未在{ready_timeout:g}秒内就绪", **result}), 504
+    return jsonify({"状态": "成功", "消息": f"{shard}服务器启动成功", **result}), 200
 
 @app.route('/stop/<shard>', methods=['POST', 'OPTIONS'])
+@app.route('/clusters/<cluster>/stop/<shard>', methods=['POST', 'OPTIONS'])
 @require_api_key
-def stop(shard):
-    if shard not in ['overworld', 'caves']:
+def stop(shard, cluster=DEFAULT_CLUSTER):
+    shard_info = get_shard(cluster, shard)
+    if shard_info is None:
         return jsonify({"状态": "错误", "消息": "指定的分片无效"}), 400
-    if stop_server(shard):
-        return jsonify({"状态": "成功", "消息": f"{shard}服务器停止成功"}), 200
+    result = stop_shards([shard_info], *stop_options_arg())[(cluster, shard_info['shard'])]
+    if result['stopped']:
+        return jsonify({"状态": "成功", "消息": f"{shard}服务器停止成功", **result}), 200
     else:
-        return jsonify({"状态": "错误", "消息": f"停止{shard}服务器失败"}), 500
+        return jsonify({"状态": "错误", "消息": f"停止{shard}服务器失败", **result}), 500
 
-@app.route('/update', methods=['POST', 'OPTIONS'])
+@app.route('/update', methods=['GET', 'POST', 'OPTIONS'])
 @require_api_key
 def update():
-    if update_server():
-        return jsonify({"状态": "成功", "消息": "服务器更新成功"}), 200
-    else:
-        return jsonify({"状态": "错误", "消息": "服务器更新失败"}), 500
+    if request.method == 'GET':
+        # ?refresh=1 立即向 Steam 查询最新版本，否则返回上次检查的结果
+        if request.args.get('refresh'):
+            return jsonify(check_for_update()), 200
+        return jsonify(update_status()), 200
+    # ?validate=1 校验全部文件，?force=1 不检查版本直接更新
+    validate = request.args.get('validate') in ('1', 'true')
+    force = request.args.get('force') in ('1', 'true')
+    return job_response('update', update_steps(validate, force), "服务器更新任务已提交")
+
+@app.route('/backups', methods=['GET', 'POST', 'OPTIONS'])
+@app.route('/clusters/<cluster>/backups', methods=['GET', 'POST', 'OPTIONS'])
+@require_api_key
+def backups(cluster=DEFAULT_CLUSTER):
+    if get_cluster(cluster) is None:
+        return cluster_not_found(cluster)
+    if request.method == 'GET':
+        return jsonify({"snapshots": [snapshot_summary(snapshot) for snapshot in list_snapshots(cluster)]}), 200
+    return job_response('backup', backup_steps([cluster]), "备份任务已提交", lock=BACKUP_ROOT)
+
+@app.route('/backups/<snapshot_id>', methods=['GET', 'DELETE', 'OPTIONS'])
+@app.route('/clusters/<cluster>/backups/<snapshot_id>', methods=['GET', 'DELETE', 'OPTIONS'])
+@require_api_key
+def backup_detail(snapshot_id, cluster=DEFAULT_CLUSTER):
+    if get_cluster(cluster) is None:
+        return cluster_not_found(cluster)
+    snapshot = load_snapshot(cluster, snapshot_id)
+    if snapshot is None:
+        return jsonify({"状态": "错误", "消息": f"快照{snapshot_id}不存在"}), 404
+    if request.method == 'GET':
+        return jsonify(snapshot_summary(snapshot)), 200
+
+    if not _backup_store_lock.acquire(blocking=False):
+        return jsonify({"状态": "错误", "消息": "备份任务正在进行，请稍后再试"}), 409
+    try:
+        delete_snapshot(cluster, snapshot_id)
+    finally:
+        _backup_store_lock.release()
+    return jsonify({"状态": "成功", "消息": f"快照{snapshot_id}已删除"}), 200
+
+@app.route('/backups/<snapshot_id>/restore', methods=['POST', 'OPTIONS'])
+@app.route('/clusters/<cluster>/backups/<snapshot_id>/restore', methods=['POST', 'OPTIONS'])
+@require_api_key
+def restore_backup(snapshot_id, cluster=DEFAULT_CLUSTER):
+    if get_cluster(cluster) is None:
+        return cluster_not_found(cluster)
+    if load_snapshot(cluster, snapshot_id) is None:
+        return jsonify({"状态": "错误", "消息": f"快照{snapshot_id}不存在"}), 404
+    return job_response('restore', restore_steps(cluster, snapshot_id), "恢复任务已提交", lock=BACKUP_ROOT)
 
 
 
 @app.route('/config', methods=['GET', 'POST', 'OPTIONS'])
+@app.route('/clusters/<cluster>/config', methods=['GET', 'POST', 'OPTIONS'])
 @require_api_key
-def config():
+def config(cluster=DEFAULT_CLUSTER):
     if request.method == 'OPTIONS':
         response = app.make_default_options_response()
         response.headers['Access-Control-Allow-Methods'] = 'GET,POST'
         response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
         return response
 
-    elif request.method == 'GET':
+    if get_cluster(cluster) is None:
+        return cluster_not_found(cluster)
+
+    if request.method == 'GET':
         try:
-            cluster_config = configparser.ConfigParser()
-            cluster_config.read(f'{CONFIG_PATH}/cluster.ini')
-            
-            # 将配置转换为中文标签
-            translated_config = {}
-            for section in cluster_config.sections():
-                translated_section = config_mapping.get(section, section)
-                translated_config[translated_section] = {}
-                for key, value in cluster_config[section].items():
-                    translated_key = config_mapping.get(key, key)
-                    translated_config[translated_section][translated_key] = value
-            
-            return jsonify(translated_config), 200
+            translated_config, etag = read_cluster_config(cluster)
         except Exception as e:
             return jsonify({"状态": "错误", "消息": f"获取配置时出错: {str(e)}"}), 500
+        response = jsonify(translated_config)
+        if etag:
+            response.set_etag(etag)
+        return response.make_conditional(request)
 
     elif request.method == 'POST':
+        new_config = request.get_json(silent=True)
+        if not new_config or not isinstance(new_config, dict):
+            return jsonify({"状态": "错误", "消息": "没有收到有效的 JSON 数据"}), 400
+        # 带 If-Match 时只在配置未被他人修改的情况下写入
+        if_match = next(iter(request.if_match.as_set()), None) if request.if_match else None
         try:
-            new_config = request.json
-            if not new_config:
-                return jsonify({"状态": "错误", "消息": "没有收到有效的 JSON 数据"}), 400
+            etag, errors = write_cluster_config(new_config, cluster, if_match)
+        except Exception as e:
+            return jsonify({"状态": "错误", "消息": f"更新配置时出错: {str(e)}"}), 500
+        if errors == 'conflict':
+            return jsonify({"状态": "错误", "消息": "配置已被修改，请刷新后重试"}), 412
+        if errors:
+            return jsonify({"状态": "错误", "消息": "配置校验失败", "错误": errors}), 400
+        response = jsonify({"状态": "成功", "消息": "配置更新成功"})
+        response.set_etag(etag)
+        return response, 200
 
-            cluster_config = configparser.ConfigParser()
-            cluster_config.read(f'{CONFIG_PATH}/cluster.ini')
+    return jsonify({"状态": "错误", "消息": "不支持的 HTTP 方法"}), 405
 
-            for section, options in new_config.items():
-                original_section = reverse_mapping.get(section, section)
-                if original_section not in cluster_config:
-                    cluster_config[original_section] = {}
-                for key, value in options.items():
-                    original_key = reverse_mapping.get(key, key)
-                    cluster_config[original_section][original_key] = str(value)
 
-            with open(f'{CONFIG_PATH}/cluster.ini', 'w') as configfile:
-                cluster_config.write(configfile)
+def shard_status_labels(cluster):
+    # 一次探测获取所有分片状态，按分片目录名返回
+    shard_status = get_server_status()
+    return {
+        shard['shard']: "运行中" if shard_status.get((cluster, shard['shard'])) else "已停止"
+        for shard in cluster_shards(cluster)
+    }
 
-            os.chown(f'{CONFIG_PATH}/cluster.ini', pwd.getpwnam('dst').pw_uid, pwd.getpwnam('dst').pw_gid)
+def section_version(data):
+    return hashlib.sha1(json.dumps(data, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
 
-            return jsonify({"状态": "成功", "消息": "配置更新成功"}), 200
-        except Exception as e:
-            return jsonify({"状态": "错误", "消息": f"更新配置时出错: {str(e)}"}), 500
-
-    return jsonify({"状态": "错误", "消息": "不支持的 HTTP 方法"}), 405
+def read_dashboard_section(section, cluster=DEFAULT_CLUSTER):
+    # 返回 (数据, 版本号)；配置和 MOD 沿用各自的 ETag/版本号，状态按内容计算
+    if section == 'status':
+        data = shard_status_labels(cluster)
+        return data, section_version(data)
+    if section == 'config':
+        data, etag = read_cluster_config(cluster)
+        return data, etag or ''
+    mods, version = read_modoverrides_versioned(cluster)
+    return mods, str(version)
 
+DASHBOARD_SECTIONS = ('status', 'config', 'mods')
 
 @app.route('/status', methods=['GET', 'OPTIONS'])
 @require_api_key
 def status():
-    overworld_status = "运行中" if check_server_status("overworld") else "已停止"
-    caves_status = "运行中" if check_server_status("caves") else "已停止"
+    # 旧接口：默认集群的主世界和洞穴
+    shard_status = get_server_status()
+    overworld_status = "运行中" if shard_status.get((DEFAULT_CLUSTER, 'Master')) else "已停止"
+    caves_status = "运行中" if shard_status.get((DEFAULT_CLUSTER, 'Caves')) else "已停止"
     return jsonify({
         "地上世界": overworld_status,
         "洞穴": caves_status
     }), 200
 
+@app.route('/dashboard', methods=['GET', 'OPTIONS'])
+@app.route('/clusters/<cluster>/dashboard', methods=['GET', 'OPTIONS'])
+@require_api_key
+def dashboard(cluster=DEFAULT_CLUSTER):
+    # 一次返回状态、配置和 MOD；?status=&config=&mods= 传入已有版本号，只返回有变化的部分
+    if get_cluster(cluster) is None:
+        return cluster_not_found(cluster)
+    sections = request.args['sections'].split(',') if request.args.get('sections') else list(DASHBOARD_SECTIONS)
+    unknown = [section for section in sections if section not in DASHBOARD_SECTIONS]
+    if unknown:
+        return jsonify({"状态": "错误", "消息": f"未知的部分: {', '.join(unknown)}"}), 400
+
+    versions = {}
+    changed = {}
+    for section in sections:
+        try:
+            data, version = read_dashboard_section(section, cluster)
+        except Exception as e:
+            return jsonify({"状态": "错误", "消息": f"读取{section}时出错: {str(e)}"}), 500
+        versions[section] = version
+        if request.args.get(section) != version:
+            changed[section] = data
+
+    unchanged = [section for section in sections if section not in changed]
+    response = jsonify({"versions": versions, "sections": changed, "unchanged": unchanged})
+    response.set_etag(section_version(versions))
+    # 客户端已有全部最新数据时直接返回 304
+    if not changed and all(section in request.args for section in sections):
+        response.status_code = 304
+        response.set_data(b'')
+        return response
+    return response.make_conditional(request)
+
+@app.route('/players', methods=['GET', 'OPTIONS'])
+@app.route('/clusters/<cluster>/players', methods=['GET', 'OPTIONS'])
+@require_api_key
+def players(cluster=None):
+    ensure_telemetry_started()
+    if cluster is not None and get_cluster(cluster) is None:
+        return cluster_not_found(cluster)
+    players = online_players(cluster)
+    with _telemetry_lock:
+        days = {f"{key[0]}/{key[1]}": day for key, day in _telemetry_state['days'].items() if cluster in (None, key[0])}
+    return jsonify({"players": players, "count": len({player['name'] for player in players}), "days": days}), 200
+
+@app.route('/events', methods=['GET', 'OPTIONS'])
+@require_api_key
+def events():
+    ensure_telemetry_started()
+    try:
+        since = int(request.args.get('since', 0))
+        limit = int(request.args.get('limit', 500))
+    except ValueError:
+        return jsonify({"状态": "错误", "消息": "since 和 limit 必须是整数"}), 400
+    kinds = set(request.args['type'].split(',')) if request.args.get('type') else None
+    result = events_since(since, limit, kinds, request.args.get('cluster'))
+    with _telemetry_lock:
+        last_id = _telemetry_state['next_id'] - 1
+    return jsonify({"events": result, "last_id": last_id}), 200
+
+@app.route('/events/stream', methods=['GET', 'OPTIONS'])
+@require_api_key
+def events_stream():
+    ensure_telemetry_started()
+    try:
+        since = int(request.args.get('since', request.headers.get('Last-Event-ID', 0)))
+    except ValueError:
+        return jsonify({"状态": "错误", "消息": "since 必须是整数"}), 400
+    response = Response(stream_with_context(stream_events(since)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/history/<shard>', methods=['GET', 'OPTIONS'])
+@app.route('/clusters/<cluster>/history/<shard>', methods=['GET', 'OPTIONS'])
+@require_api_key
+def history(shard, cluster=DEFAULT_CLUSTER):
+    ensure_history_started()
+    shard_info = get_shard(cluster, shard)
+    if shard_info is None:
+        return jsonify({"状态": "错误", "消息": "指定的分片无效"}), 400
+    try:
+        seconds = parse_history_range(request.args.get('range', '24h'))
+    except ValueError:
+        return jsonify({"状态": "错误", "消息": "range 格式应为 90、30m、24h 或 7d"}), 400
+    if seconds <= 0:
+        return jsonify({"状态": "错误", "消息": "range 必须大于 0"}), 400
+
+    level, bucket, points = query_history((cluster, shard_info['shard']), seconds)
+    covered = sum(point['running'] for point in points)
+    return jsonify({
+        "shard": shard_info['shard'],
+        "range": seconds,
+        "resolution": bucket,
+        "source_level": level,
+        "uptime_ratio": round(covered / len(points), 3) if points else None,
+        "starts": sum(point['starts'] for point in points),
+        "peak_players": max((point['players_max'] for point in points), default=0),
+        "points": points
+    }), 200
+
+@app.route('/resources/<shard>', methods=['GET', 'OPTIONS'])
+@app.route('/clusters/<cluster>/resources/<shard>', methods=['GET', 'OPTIONS'])
+@require_api_key
+def resources(shard, cluster=DEFAULT_CLUSTER):
+    ensure_resource_monitor_started()
+    shard_info = get_shard(cluster, shard)
+    if shard_info is None:
+        return jsonify({"状态": "错误", "消息": "指定的分片无效"}), 400
+    try:
+        since = float(request.args['since']) if 'since' in request.args else None
+        points = int(request.args.get('points', 120))
+    except ValueError:
+        return jsonify({"状态": "错误", "消息": "since 必须是数字，points 必须是整数"}), 400
+
+    key = (cluster, shard_info['shard'])
+    history = resource_history(key, since)
+    return jsonify({
+        "shard": shard_info['shard'],
+        "running": check_server_status(shard_info['shard'], cluster),
+        "interval": RESOURCE_INTERVAL,
+        "current": history[-1] if history else None,
+        "history": downsample_resources(history, points),
+        "thresholds": {"rss": RESOURCE_ALERT_RSS, "cpu": RESOURCE_ALERT_CPU, "samples": RESOURCE_ALERT_SAMPLES},
+        "auto_restart": RESOURCE_AUTO_RESTART
+    }), 200
+
+@app.route('/console/<shard>', methods=['POST', 'OPTIONS'])
+@app.route('/clusters/<cluster>/console/<shard>', methods=['POST', 'OPTIONS'])
+@require_api_key
+def console(shard, cluster=DEFAULT_CLUSTER):
+    shard_info = get_shard(cluster, shard)
+    if shard_info is None:
+        return jsonify({"状态": "错误", "消息": "指定的分片无效"}), 400
+
+    body = request.get_json(silent=True) or {}
+    commands = body.get('commands', [body['command']] if 'command' in body else [])
+    if isinstance(commands, str):
+        commands = [commands]
+    # 多行输入按行拆成多条命令
+    commands = [line.strip() for command in commands for line in str(command).splitlines() if line.strip()]
+    if not commands:
+        return jsonify({"状态": "错误", "消息": "没有收到命令"}), 400
+    if len(commands) > CONSOLE_MAX_COMMANDS or any(len(command) > CONSOLE_MAX_COMMAND_LENGTH for command in commands):
+        return jsonify({"状态": "错误", "消息": f"最多{CONSOLE_MAX_COMMANDS}条命令，每条不超过{CONSOLE_MAX_COMMAND_LENGTH}个字符"}), 400
+    if not check_server_status(shard_info['shard'], cluster):
+        return jsonify({"状态": "错误", "消息": f"{shard}服务器未运行"}), 409
+
+    result = send_console_commands(shard_info, commands)
+    if result is None:
+        return jsonify({"状态": "错误", "消息": "命令队列已满，请稍后再试"}), 429
+    if not result['sent']:
+        return jsonify({"状态": "错误", "消息": f"发送命令失败: {result['error']}"}), 500
+    return jsonify({"状态": "成功", "消息": "命令已发送", "batch": result['commands'], "output": result['output']}), 200
+
+@app.route('/logs/search', methods=['GET', 'OPTIONS'])
+@app.route('/clusters/<cluster>/logs/search', methods=['GET', 'OPTIONS'])
+@require_api_key
+def search_logs_route(cluster=DEFAULT_CLUSTER):
+    # 静态路径 /logs/search 优先于 /logs/<shard> 匹配，不会被当成名为 search 的分片
+    if get_cluster(cluster) is None:
+        return cluster_not_found(cluster)
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"状态": "错误", "消息": "缺少搜索内容 q"}), 400
+    if request.args.get('shard'):
+        shard_info = get_shard(cluster, request.args['shard'])
+        if shard_info is None:
+            return jsonify({"状态": "错误", "消息": "指定的分片无效"}), 400
+        shards = [shard_info]
+    else:
+        shards = cluster_shards(cluster)
+
+    try:
+        start = float(request.args['from']) if request.args.get('from') else None
+        end = float(request.args['to']) if request.args.get('to') else None
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = min(max(1, int(request.args.get('limit', LOG_SEARCH_PAGE_SIZE))), LOG_SEARCH_MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"状态": "错误", "消息": "from 和 to 必须是时间戳，offset 和 limit 必须是整数"}), 400
+
+    total, results = search_logs(query, shards, start, end, offset, limit)
+    next_offset = offset + len(results) if offset + len(results) < total else None
+    return jsonify({
+        "query": query,
+        "total": total,
+        "offset": offset,
+        "next_offset": next_offset,
+        "results": results,
+        "index": log_index_stats()
+    }), 200
+
 @app.route('/logs/<shard>', methods=['GET', 'OPTIONS'])
+@app.route('/clusters/<cluster>/logs/<shard>', methods=['GET', 'OPTIONS'])
 @require_api_key
-def get_logs(shard):
-    if shard not in ['overworld', 'caves']:
+def get_logs(shard, cluster=DEFAULT_CLUSTER):
+    shard_info = get_shard(cluster, shard)
+    if shard_info is None:
         return jsonify({"状态": "错误", "消息": "指定的分片无效"}), 400
     
-    log_file = f"{CONFIG_PATH}/{'Master' if shard == 'overworld' else 'Caves'}/server_log.txt"
+    log_file = shard_log_path(shard_info)
     if not os.path.exists(log_file):
         return jsonify({"状态": "错误", "消息": "日志文件不存在"}), 404
-    
-    return send_file(log_file, as_attachment=True)
+
+    if request.args.get('download'):
+        return send_file(log_file, as_attachment=True)
+
+    try:
+        offset = request.args.get('offset', request.headers.get('Last-Event-ID'))
+        offset = int(offset) if offset is not None else None
+        lines = int(request.args.get('lines', LOG_TAIL_LINES))
+    except ValueError:
+        return jsonify({"状态": "错误", "消息": "offset 和 lines 必须是整数"}), 400
+    if (offset is not None and offset < 0) or lines < 0:
+        return jsonify({"状态": "错误", "消息": "offset 和 lines 不能为负数"}), 400
+
+    if request.args.get('follow'):
+        if offset is None:
+            offset = os.path.getsize(log_file)
+        response = Response(stream_with_context(follow_log(log_file, offset)), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    if offset is not None:
+        data, next_offset, size = read_log_from(log_file, offset)
+        start = next_offset - len(data)
+    else:
+        data, start, next_offset = tail_log_lines(log_file, lines)
+        size = max(next_offset, os.path.getsize(log_file))
+
+    return jsonify({
+        "shard": shard,
+        "offset": start,
+        "next_offset": next_offset,
+        "size": size,
+        "content": data.decode('utf-8', 'replace')
+    }), 200
+
+class PooledWSGIServer(BaseWSGIServer):
+    # 请求交给固定大小的线程池处理，一个阻塞的子进程调用不会拖住其他请求；
+    # 连接在响应后关闭（HTTP/1.0），空闲的长连接不会占住工作线程
+    def __init__(self, host, port, app, threads=SERVER_THREADS):
+        super().__init__(host, port, app)
+        self.multithread = True
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='dst-http')
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle_request, request, client_address)
+
+    def _handle_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+def _raise_system_exit(signum, frame):
+    raise SystemExit(0)
+
+def shutdown_background():
+    # 结束 SSE 长连接，取消排队中的后台任务；正在运行的任务会在进程退出前执行完
+    _shutdown_event.set()
+    with _telemetry_lock:
+        _telemetry_lock.notify_all()
+    _job_executor.shutdown(wait=False, cancel_futures=True)
+    with _jobs_lock:
+        running = [job['id'] for job in _jobs.values() if job['status'] == 'running']
+    if running:
+        logger.warning(f"等待正在运行的任务结束: {', '.join(running)}")
+
+def serve(host=SERVER_HOST, port=SERVER_PORT, threads=SERVER_THREADS):
+    server = PooledWSGIServer(host, port, app, threads)
+    signal.signal(signal.SIGTERM, _raise_system_exit)
+    logger.info(f"控制面板已启动: http://{host}:{server.server_port}（{threads}个工作线程）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info("正在关闭控制面板...")
+        server.server_close()
+        shutdown_background()
+
+_background_started = threading.Event()
+
+def start_background():
+    if _background_started.is_set():
+        return
+    _background_started.set()
+    ensure_telemetry_started()
+    ensure_backup_scheduler_started()
+    ensure_update_scheduler_started()
+    ensure_resource_monitor_started()
+    ensure_history_started()
+
+@app.before_request
+def start_background_on_request():
+    # 由外部 WSGI 服务器加载（main:app）时不会执行 __main__，在第一个请求时启动后台线程
+    start_background()
 
 if __name__ == '__main__':
-    server_host = '0.0.0.0'
-    server_port = 5000
-    app.run(host=server_host, port=server_port, debug=True)
\ No newline at end of file
+    start_background()
+    if SERVER_MODE == 'debug':
+        app.run(host=SERVER_HOST, port=SERVER_PORT, debug=True)
+    else:
+        serve()
\ No newline at end of file
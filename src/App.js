@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { 
   Container, Typography, Box, Button, Paper, TextField, Grid, CircularProgress,
   ThemeProvider, createTheme, CssBaseline, AppBar, Toolbar, IconButton, List, ListItem, ListItemText
@@ -14,6 +14,7 @@ import axios from 'axios';
 
 const API_BASE_URL = 'http://192.168.150.138:5000';
 const API_KEY = '123';
+const JOB_POLL_INTERVAL = 2000;
 
 axios.defaults.headers.common['X-API-Key'] = API_KEY;
 
@@ -32,7 +33,7 @@ const theme = createTheme({
 });
 
 function App() {
-  const [status, setStatus] = useState({ overworld: '未知', caves: '未知' });
+  const [status, setStatus] = useState({ Master: '未知', Caves: '未知' });
   const [config, setConfig] = useState({});
   const [mods, setMods] = useState({});
   const [loading, setLoading] = useState(false);
@@ -41,43 +42,47 @@ function App() {
   const [actionLoading, setActionLoading] = useState({});
   const [message, setMessage] = useState('');
 
+  // 各部分的版本号，请求时带上，后端只返回有变化的部分
+  const versions = useRef({});
+
   useEffect(() => {
-    fetchStatus();
-    fetchConfig();
-    fetchMods();
+    setLoadingConfig(true);
+    fetchDashboard().then(() => setLoadingConfig(false));
   }, []);
 
-  const fetchStatus = async () => {
+  const fetchDashboard = async () => {
     setLoadingStatus(true);
     try {
-      const response = await axios.get(`${API_BASE_URL}/status`);
-      setStatus(response.data);
+      // 304 表示所有部分都没有变化
+      const response = await axios.get(`${API_BASE_URL}/dashboard`, {
+        params: versions.current,
+        validateStatus: (code) => code === 200 || code === 304
+      });
+      if (response.status === 200) {
+        const { sections } = response.data;
+        if (sections.status) setStatus(sections.status);
+        if (sections.config) setConfig(sections.config);
+        if (sections.mods) setMods(sections.mods);
+        versions.current = response.data.versions;
+      }
     } catch (error) {
-      console.error('获取状态时出错:', error);
-      setMessage('获取状态时出错: ' + error.message);
+      console.error('获取服务器信息时出错:', error);
+      setMessage('获取服务器信息时出错: ' + error.message);
     }
     setLoadingStatus(false);
   };
 
-  const fetchConfig = async () => {
-    setLoadingConfig(true);
-    try {
-      const response = await axios.get(`${API_BASE_URL}/config`);
-      setConfig(response.data);
-    } catch (error) {
-      console.error('获取配置时出错:', error);
-      setMessage('获取配置时出错: ' + error.message);
-    }
-    setLoadingConfig(false);
-  };
-
-  const fetchMods = async () => {
-    try {
-      const response = await axios.get(`${API_BASE_URL}/mods`);
-      setMods(response.data.mods);
-    } catch (error) {
-      console.error('获取MOD列表时出错:', error);
-      setMessage('获取MOD列表时出错: ' + error.message);
+  const waitForJob = async (jobId) => {
+    while (true) {
+      const response = await axios.get(`${API_BASE_URL}/jobs/${jobId}`);
+      const job = response.data;
+      if (job.status === 'done' || job.status === 'failed') {
+        return job;
+      }
+      if (job.current_step) {
+        setMessage(`正在${job.current_step}...`);
+      }
+      await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL));
     }
   };
 
@@ -87,18 +92,23 @@ function App() {
     try {
       let response;
       if (action === 'install' || action === 'update') {
+        // 409 表示已有任务在运行，直接跟踪该任务
+        response = await axios.post(`${API_BASE_URL}/${action}`, null, {
+          validateStatus: (code) => code === 202 || code === 409
+        });
+        setMessage(response.data.消息);
+        const job = await waitForJob(response.data.job_id);
+        if (job.status === 'failed') {
+          throw new Error(job.error);
+        }
+      } else if (action === 'start_all' || action === 'stop_all') {
+        // 后端并行操作所有分片
         response = await axios.post(`${API_BASE_URL}/${action}`);
-      } else if (action === 'start_all') {
-        await axios.post(`${API_BASE_URL}/start/overworld`);
-        response = await axios.post(`${API_BASE_URL}/start/caves`);
-      } else if (action === 'stop_all') {
-        await axios.post(`${API_BASE_URL}/stop/overworld`);
-        response = await axios.post(`${API_BASE_URL}/stop/caves`);
       } else {
         response = await axios.post(`${API_BASE_URL}/${action}/${shard}`);
       }
       setMessage(response.data.message);
-      fetchStatus();
+      fetchDashboard();
     } catch (error) {
       console.error(`${action}过程中出错:`, error);
       setMessage(`${action}过程中出错: ${error.response ? error.response.data.message : error.message}`);
@@ -137,7 +147,7 @@ function App() {
           <Typography variant="h6" component="div" sx={{ flexGrow: 1 }}>
             饥荒联机版服务器管理器
           </Typography>
-          <IconButton color="inherit" onClick={fetchStatus} disabled={loadingStatus}>
+          <IconButton color="inherit" onClick={fetchDashboard} disabled={loadingStatus}>
             <RefreshIcon />
           </IconButton>
         </Toolbar>
@@ -163,15 +173,15 @@ function App() {
                 ) : (
                   <Grid container spacing={2}>
                     <Grid item xs={6}>
-                      <Paper elevation={1} sx={{ p: 2, bgcolor: status.地上世界 === '运行中' ? 'success.light' : 'error.light' }}>
+                      <Paper elevation={1} sx={{ p: 2, bgcolor: status.Master === '运行中' ? 'success.light' : 'error.light' }}>
                         <Typography variant="h6">主世界</Typography>
-                        <Typography variant="body1">{status.地上世界}</Typography>
+                        <Typography variant="body1">{status.Master}</Typography>
                       </Paper>
                     </Grid>
                     <Grid item xs={6}>
-                      <Paper elevation={1} sx={{ p: 2, bgcolor: status.洞穴 === '运行中' ? 'success.light' : 'error.light' }}>
+                      <Paper elevation={1} sx={{ p: 2, bgcolor: status.Caves === '运行中' ? 'success.light' : 'error.light' }}>
                         <Typography variant="h6">洞穴</Typography>
-                        <Typography variant="body1">{status.洞穴}</Typography>
+                        <Typography variant="body1">{status.Caves}</Typography>
                       </Paper>
                     </Grid>
                   </Grid>